@@ -0,0 +1,77 @@
+import time
+import random
+import difflib
+import argparse
+
+from ugit import _linediff
+
+
+def generated_code(lines, rng):
+    # Mostly the same few lines over and over, like generated code
+    out = []
+    while len(out) < lines:
+        name = f"field_{rng.randrange(lines // 10)}"
+        out += [f"    def get_{name}(self):", f"        return self._{name}", "", "    @property"]
+    return out[:lines]
+
+def lockfile(lines, rng):
+    out = []
+    while len(out) < lines:
+        package = f"package-{rng.randrange(lines)}"
+        out += [f'"{package}": {{', f'  "version": "{rng.randrange(10)}.{rng.randrange(10)}.0",', '  "dev": false', '},']
+    return out[:lines]
+
+def csv(lines, rng):
+    return [f"{rng.randrange(100)},{rng.choice(['a', 'b', 'c'])},{rng.randrange(2)}" for _ in range(lines)]
+
+def edit(lines, count, rng):
+    lines = list(lines)
+    for _ in range(count):
+        pos = rng.randrange(len(lines))
+        kind = rng.randrange(3)
+        if kind == 0:
+            del lines[pos:pos + rng.randrange(1, 20)]
+        elif kind == 1:
+            lines[pos:pos] = [f"inserted {rng.random()}" for _ in range(rng.randrange(1, 20))]
+        else:
+            lines[pos] = f"changed {rng.random()}"
+    return lines
+
+def run_difflib(a, b):
+    return list(difflib.unified_diff(a, b, 'a', 'b', lineterm=''))
+
+def run_algorithm(algorithm):
+    def run(a, b):
+        return list(_linediff.unified_diff(a, b, 'a', 'b', algorithm=algorithm))
+    return run
+
+def measure(name, run, a, b):
+    start = time.perf_counter()
+    output = run(a, b)
+    elapsed = time.perf_counter() - start
+    changed = sum(1 for line in output if line[:1] in '+-' and line[:3] not in ('---', '+++'))
+    print(f"  {name:<12} {elapsed:>10.3f} {changed:>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare difflib with the _linediff algorithms')
+    parser.add_argument('--lines', type=int, default=20000)
+    parser.add_argument('--edits', type=int, default=200)
+    parser.add_argument('--skip-difflib', action='store_true')
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    runners = {'myers': run_algorithm('myers'), 'histogram': run_algorithm('histogram')}
+    if not args.skip_difflib:
+        runners = {'difflib': run_difflib, **runners}
+
+    for make in (generated_code, lockfile, csv):
+        a = make(args.lines, rng)
+        b = edit(a, args.edits, rng)
+        print(f"{make.__name__} ({len(a)} -> {len(b)} lines)")
+        print(f"  {'algorithm':<12} {'time (s)':>10} {'+/- lines':>10}")
+        for name, run in runners.items():
+            measure(name, run, a, b)
+
+
+if __name__ == '__main__':
+    main()
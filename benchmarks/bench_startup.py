@@ -0,0 +1,112 @@
+import os
+import re
+import sys
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+import orjson
+
+import synthetic_repo
+from bench_suite import compare
+
+# Runs common commands in fresh interpreters under -X importtime and
+# reports the median time spent importing, which is what dominates short
+# commands in scripts. Wall time is reported too but not compared: it also
+# counts interpreter startup and the command's own work.
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHAPE = {'files': 50, 'commits': 5, 'files_per_commit': 5, 'merge_every': 0}
+COMMANDS = {
+    'status': ['status'],
+    'branch': ['branch'],
+    'log': ['log'],
+    'diff': ['diff'],
+    'cat-file': ['cat-file', '@'],
+    'hash-object': ['hash-object', '.ugitignore'],
+}
+# Top level imports are the unindented names; their cumulative times add
+# up to the whole
+IMPORT_LINE = re.compile(r'import time:\s+\d+ \|\s+(\d+) \| (\S.*)')
+
+
+def import_time(stderr):
+    # Everything up to site is interpreter startup, the same whatever ugit
+    # does and noisy with whatever .pth files are installed
+    total = None
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        if total is None:
+            if match.group(2) == 'site':
+                total = 0
+            continue
+        total += int(match.group(1))
+    return (total or 0) / 1e6
+
+def time_command(repo, args, env):
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-m', 'ugit.cli', *args],
+        cwd=repo, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+    )
+    wall = time.perf_counter() - start
+    assert proc.returncode == 0, f"ugit {' '.join(args)} failed:\n{proc.stderr}"
+    return import_time(proc.stderr), wall
+
+def run(repo, repeat):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [PACKAGE_ROOT, env.get('PYTHONPATH')]))
+    env.pop('UGIT_TRACE', None)
+    results = {}
+    for name, args in COMMANDS.items():
+        # One untimed run so every run reads compiled bytecode
+        time_command(repo, args, env)
+        imports, walls = zip(*(time_command(repo, args, env) for _ in range(repeat)))
+        results[name] = {
+            'median': statistics.median(imports), 'min': min(imports),
+            'wall': statistics.median(walls), 'runs': repeat,
+        }
+        print(f"{name:<12} {results[name]['median']:>10.4f} {results[name]['wall']:>10.4f}", file=sys.stderr)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the imports of common ugit commands')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare against results of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown before failing, 0.25 is 25%%')
+    parser.add_argument('--min-delta', type=float, default=0.005, help='Slowdowns under this many seconds are never regressions')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        synthetic_repo.generate(f"{tmp}/repo", SHAPE)
+        results = run(f"{tmp}/repo", args.repeat)
+    report = {
+        'repeat': args.repeat,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    output = orjson.dumps(report, option=orjson.OPT_INDENT_2)
+    if args.output:
+        with open(args.output, 'wb') as f:
+            f.write(output)
+    else:
+        sys.stdout.buffer.write(output + b'\n')
+
+    if args.baseline:
+        with open(args.baseline, 'rb') as f:
+            baseline = orjson.loads(f.read())
+        if baseline.get('python') != report['python']:
+            print("Warning: the baseline was run on a different Python", file=sys.stderr)
+        if compare(results, baseline, args.tolerance, args.min_delta):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
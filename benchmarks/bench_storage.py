@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+from ugit import data
+from ugit import _codec
+
+
+def generate_blobs(versions, lines, edits, seed=0):
+    # Versions of one slowly changing text file, each editing a few lines
+    rng = random.Random(seed)
+    content = [f"line {i} {rng.random()}\n" for i in range(lines)]
+    for _ in range(versions):
+        for _ in range(edits):
+            content[rng.randrange(lines)] = f"edited {rng.random()}\n"
+        yield ''.join(content).encode()
+
+def objects_size(git_dir):
+    total = 0
+    for root, _, filenames in os.walk(f"{git_dir}/objects"):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in filenames)
+    return total
+
+def run(name, blobs, codec, pack):
+    with tempfile.TemporaryDirectory() as tmp:
+        with data.change_git_dir(tmp):
+            data.OBJECT_CODEC = codec
+            start = time.perf_counter()
+            oids = [data.hash_object(blob) for blob in blobs]
+            if pack:
+                data.repack(codec)
+            write_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for oid in oids:
+                data.get_object(oid)
+            read_time = time.perf_counter() - start
+            size = objects_size(data.GIT_DIR)
+            data._close_packs()
+    print(f"{name:<12} {size / 1024:>12.1f} {write_time:>10.3f} {read_time / len(oids) * 1e6:>14.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare on-disk object size and get_object latency')
+    parser.add_argument('--versions', type=int, default=100)
+    parser.add_argument('--lines', type=int, default=5000)
+    parser.add_argument('--edits', type=int, default=5)
+    args = parser.parse_args()
+
+    blobs = list(generate_blobs(args.versions, args.lines, args.edits))
+    codec = data.OBJECT_CODEC
+    print(f"{len(blobs)} blobs, {sum(map(len, blobs)) / 1024:.1f} KiB total", file=sys.stderr)
+    print(f"{'format':<12} {'size (KiB)':>12} {'write (s)':>10} {'read (us/obj)':>14}")
+    try:
+        run('loose', blobs, 'none', pack=False)
+        for name in _codec.CODECS:
+            if name != 'none':
+                run(f'loose-{name}', blobs, name, pack=False)
+                run(f'pack-{name}', blobs, name, pack=True)
+    finally:
+        data.OBJECT_CODEC = codec
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+import io
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import contextlib
+
+import orjson
+
+from ugit import cli
+from ugit import data
+from ugit import base
+from ugit import _remote
+
+import synthetic_repo
+
+# Operations are timed on a generated repository, each run repeat times.
+# Results are written as JSON; given a baseline from an earlier run, any
+# operation whose median got slower by more than the tolerance is reported
+# and the exit status is 1.
+
+
+@contextlib.contextmanager
+def in_repo(path):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        with data.change_git_dir(path):
+            yield
+    finally:
+        os.chdir(cwd)
+
+def quiet(function, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+def touch_files(count, rng):
+    paths = sorted(path for path in base.get_index_tree())
+    for path in rng.sample(paths, min(count, len(paths))):
+        with open(path, 'a') as f:
+            f.write(f"bench {rng.random()}\n")
+
+class Suite:
+
+    def __init__(self, path, branches, remote, touched):
+        self.path = path
+        self.branches = branches
+        self.remote = remote
+        self.touched = touched
+        self.fetch_path = f"{path}-fetch"
+        self.rng = random.Random(0)
+
+    def operations(self):
+        return {
+            'add': (self.setup_add, lambda: quiet(base.add, ['.'])),
+            'write_tree': (None, base.write_tree),
+            'commit': (self.setup_add_and_stage, lambda: base.commit('bench')),
+            'status': (None, lambda: quiet(cli.status)),
+            'diff': (self.setup_add, lambda: quiet(cli.diff, None, False, False)),
+            'log': (None, lambda: quiet(cli.log, base.get_oid('@'))),
+            'checkout': (None, self.checkout_round_trip),
+            'merge_base': (None, self.merge_base),
+            'merge': (self.setup_merge, self.merge),
+            'fetch': (self.setup_fetch, self.fetch),
+            'push': (self.setup_push, lambda: _remote.push(self.remote, 'refs/heads/bench-push')),
+        }
+
+    def setup_add(self):
+        touch_files(self.touched, self.rng)
+
+    def setup_add_and_stage(self):
+        touch_files(self.touched, self.rng)
+        quiet(base.add, ['.'])
+
+    def checkout_round_trip(self):
+        other = self.branches[-1] if len(self.branches) > 1 else 'master'
+        base.checkout(other)
+        base.checkout('master')
+
+    def merge_base(self):
+        heads = [base.get_oid(branch) for branch in self.branches]
+        for other in heads[1:] or heads:
+            base.get_merge_base(heads[0], other)
+
+    def setup_merge(self):
+        # Merge onto a throwaway branch so master stays put
+        if data.get_ref('MERGED_HEAD').value:
+            data.delete_ref('MERGED_HEAD', deref=False)
+        base.checkout('master')
+        base.create_branch('bench-merge', base.get_oid('master'))
+        base.checkout('bench-merge')
+
+    def merge(self):
+        other = self.branches[-1] if len(self.branches) > 1 else 'master'
+        quiet(base.merge, base.get_oid(other))
+
+    def setup_fetch(self):
+        # Fetch everything again into an empty repository
+        self.cleanup_merge()
+        shutil.rmtree(self.fetch_path, ignore_errors=True)
+        os.makedirs(self.fetch_path)
+        with in_repo(self.fetch_path):
+            base.init()
+
+    def fetch(self):
+        with in_repo(self.fetch_path):
+            _remote.fetch(self.remote)
+
+    def setup_push(self):
+        self.cleanup_merge()
+        touch_files(self.touched, self.rng)
+        quiet(base.add, ['.'])
+        base.create_branch('bench-push', base.commit('push'))
+
+    def cleanup_merge(self):
+        if data.get_ref('MERGED_HEAD').value:
+            data.delete_ref('MERGED_HEAD', deref=False)
+        if base.get_branch_name() != 'master':
+            base.checkout('master')
+
+
+def run(path, shape, repeat, touched):
+    remote = f"{path}-remote"
+    branches = synthetic_repo.generate(path, shape)
+    synthetic_repo.generate(remote, shape)
+    results = {}
+    with in_repo(path):
+        suite = Suite(os.path.abspath(path), branches, os.path.abspath(remote), touched)
+        for name, (setup, operation) in suite.operations().items():
+            times = []
+            for _ in range(repeat):
+                if setup:
+                    setup()
+                start = time.perf_counter()
+                operation()
+                times.append(time.perf_counter() - start)
+            suite.cleanup_merge()
+            results[name] = {'median': statistics.median(times), 'min': min(times), 'runs': len(times)}
+            print(f"{name:<12} {results[name]['median']:>10.4f} {results[name]['min']:>10.4f}", file=sys.stderr)
+    return results
+
+def compare(results, baseline, tolerance, min_delta):
+    # Operations whose median is slower than the baseline by more than
+    # tolerance, ignoring differences under min_delta seconds, which are noise
+    regressions = []
+    print(f"{'operation':<12} {'baseline':>10} {'current':>10} {'ratio':>8}")
+    for name, result in results.items():
+        previous = baseline['results'].get(name)
+        if not previous:
+            continue
+        ratio = result['median'] / previous['median'] if previous['median'] else float('inf')
+        flag = ''
+        if ratio > 1 + tolerance and result['median'] - previous['median'] > min_delta:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<12} {previous['median']:>10.4f} {result['median']:>10.4f} {ratio:>8.2f}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Time core ugit operations on a synthetic repository')
+    for key, value in synthetic_repo.DEFAULT_SHAPE.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(value), default=value)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--touched', type=int, default=20, help='Files modified before add, diff, commit and push')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare against results of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown before failing, 0.25 is 25%%')
+    parser.add_argument('--min-delta', type=float, default=0.005, help='Slowdowns under this many seconds are never regressions')
+    args = parser.parse_args()
+    shape = {key: getattr(args, key) for key in synthetic_repo.DEFAULT_SHAPE}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = run(f"{tmp}/repo", shape, args.repeat, args.touched)
+    report = {
+        'shape': shape,
+        'repeat': args.repeat,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    output = orjson.dumps(report, option=orjson.OPT_INDENT_2)
+    if args.output:
+        with open(args.output, 'wb') as f:
+            f.write(output)
+    else:
+        sys.stdout.buffer.write(output + b'\n')
+
+    if args.baseline:
+        with open(args.baseline, 'rb') as f:
+            baseline = orjson.loads(f.read())
+        if baseline.get('shape') != shape:
+            print("Warning: the baseline was run on a different repository shape", file=sys.stderr)
+        if compare(results, baseline, args.tolerance, args.min_delta):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
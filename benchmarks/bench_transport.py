@@ -0,0 +1,104 @@
+import os
+import io
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import contextlib
+
+from ugit import data
+from ugit import base
+from ugit import _transport
+
+
+def make_commits(count, files, rng):
+    for i in range(count):
+        for _ in range(3):
+            path = f"dir{rng.randrange(10)}/file{rng.randrange(files)}.txt"
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'a') as f:
+                f.write(f"line {rng.random()}\n" * 20)
+        with contextlib.redirect_stdout(io.StringIO()):
+            base.add(['.'])
+        base.commit(f"commit {i}")
+
+def copy_fetch(remote, local):
+    # The old transfer: walk the remote history and copy every loose object
+    # file the local repository doesn't have yet
+    copied = size = 0
+    with data.change_git_dir(remote):
+        tips = [ref.value for _, ref in data.iter_refs('refs/heads/')]
+        oids = list(base.iter_objects_in_commits(tips))
+    for oid in oids:
+        source = f"{remote}/.ugit/objects/{oid[:2]}/{oid[2:]}"
+        target = f"{local}/.ugit/objects/{oid[:2]}/{oid[2:]}"
+        if os.path.isfile(target):
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copy(source, target)
+        copied += 1
+        size += os.path.getsize(target)
+    return {'objects': copied, 'bytes': size, 'round_trips': copied}
+
+def transport_fetch(remote, local):
+    with data.change_git_dir(local):
+        with _transport.connect(remote) as connection:
+            refs = _transport.ls_refs(connection, 'refs/heads/')
+            wants = {oid for oid in refs.values() if not data.object_exists(oid)}
+            tips = {ref.value for _, ref in data.iter_refs()}
+            haves = _transport.negotiate(connection, tips)
+            _transport.fetch_pack(connection, wants, haves)
+        for refname, oid in refs.items():
+            data.update_ref(refname, data.RefValue(symbolic=False, value=oid))
+    return {
+        'objects': None,
+        'bytes': connection.bytes_received + connection.bytes_sent,
+        'round_trips': connection.round_trips,
+    }
+
+def measure(name, fetch, remote, local):
+    start = time.perf_counter()
+    result = fetch(remote, local)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {result['bytes'] / 1024:>12.1f} {result['round_trips']:>12} {elapsed:>10.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-object copies with the pack transport')
+    parser.add_argument('--commits', type=int, default=100)
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--incremental', type=int, default=10)
+    args = parser.parse_args()
+    rng = random.Random(0)
+    cwd = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        remote = f"{tmp}/remote"
+        os.makedirs(remote)
+        os.chdir(remote)
+        try:
+            with open('.ugitignore', 'w') as f:
+                f.write('.ugit\n.ugitignore\n')
+            with data.change_git_dir('.'):
+                base.init()
+                make_commits(args.commits, args.files, rng)
+            locals_ = {name: f"{tmp}/{name}" for name in ('copy', 'transport')}
+            for local in locals_.values():
+                os.makedirs(local)
+                with data.change_git_dir(local):
+                    base.init()
+
+            print(f"{'fetch':<28} {'bytes (KiB)':>12} {'round trips':>12} {'time (s)':>10}")
+            measure('clone, copy', copy_fetch, remote, locals_['copy'])
+            measure('clone, transport', transport_fetch, remote, locals_['transport'])
+
+            with data.change_git_dir('.'):
+                make_commits(args.incremental, args.files, rng)
+            measure('incremental, copy', copy_fetch, remote, locals_['copy'])
+            measure('incremental, transport', transport_fetch, remote, locals_['transport'])
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import io
+import os
+import random
+import argparse
+import contextlib
+
+from ugit import data
+from ugit import base
+
+WORDS = [
+    'alpha', 'beta', 'gamma', 'delta', 'value', 'return', 'self', 'index', 'tree',
+    'commit', 'object', 'for', 'in', 'if', 'else', 'None', 'True', 'False', '=', '+',
+]
+
+# The shape of a generated repository. The same shape and seed always give
+# the same files, commits and oids.
+DEFAULT_SHAPE = {
+    'files': 1000,
+    'depth': 3,
+    'file_lines': 50,
+    'commits': 50,
+    'files_per_commit': 10,
+    # Chance that a commit starts a new branch off the current one
+    'branchiness': 0.1,
+    # Every this many commits, a branch is merged back into master
+    'merge_every': 10,
+    'seed': 0,
+}
+
+
+def _line(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randrange(2, 12))) + '\n'
+
+def _paths(shape, rng):
+    fanout = max(2, round(shape['files'] ** (1 / (shape['depth'] + 1))))
+    paths = []
+    for i in range(shape['files']):
+        depth = rng.randrange(shape['depth'] + 1)
+        dirs = [f"d{rng.randrange(fanout)}" for _ in range(depth)]
+        paths.append('/'.join(dirs + [f"f{i}.txt"]))
+    return paths
+
+def _write(path, lines):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        f.writelines(lines)
+
+def _edit(path, rng):
+    with open(path) as f:
+        lines = f.readlines()
+    for _ in range(rng.randrange(1, 4)):
+        lines[rng.randrange(len(lines))] = _line(rng)
+    _write(path, lines)
+
+def _quiet(function, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args)
+
+def generate(path, shape=None):
+    # Creates the repository at path, which must be empty, and returns the
+    # branch names it made
+    shape = {**DEFAULT_SHAPE, **(shape or {})}
+    rng = random.Random(shape['seed'])
+    os.makedirs(path, exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        with open('.ugitignore', 'w') as f:
+            f.write('.ugit\n.ugitignore\n')
+        with data.change_git_dir(os.getcwd()):
+            base.init()
+            paths = _paths(shape, rng)
+            for file_path in paths:
+                _write(file_path, [_line(rng) for _ in range(shape['file_lines'])])
+            _quiet(base.add, ['.'])
+            base.commit('initial')
+
+            branches = ['master']
+            current = 'master'
+            for i in range(1, shape['commits']):
+                if shape['merge_every'] and i % shape['merge_every'] == 0 and len(branches) > 1:
+                    base.checkout('master')
+                    current = 'master'
+                    other = rng.choice(branches[1:])
+                    _quiet(base.merge, base.get_oid(other))
+                    base.commit(f"merge {other}")
+                    continue
+                if rng.random() < shape['branchiness']:
+                    name = f"branch{len(branches)}"
+                    base.create_branch(name, base.get_oid('@'))
+                    base.checkout(name)
+                    branches.append(name)
+                    current = name
+                changed = rng.sample(paths, min(shape['files_per_commit'], len(paths)))
+                for file_path in changed:
+                    _edit(file_path, rng)
+                _quiet(base.add, changed)
+                base.commit(f"commit {i} on {current}")
+            if current != 'master':
+                base.checkout('master')
+            return branches
+    finally:
+        os.chdir(cwd)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic ugit repository')
+    parser.add_argument('path')
+    for key, value in DEFAULT_SHAPE.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args()
+    shape = {key: getattr(args, key) for key in DEFAULT_SHAPE}
+    branches = generate(args.path, shape)
+    print(f"Generated {args.path} with {len(branches)} branches")
+
+
+if __name__ == '__main__':
+    main()
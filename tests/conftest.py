@@ -0,0 +1,36 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+from ugit import data
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    # An empty repository in a fresh directory, used in-process
+    monkeypatch.chdir(tmp_path)
+    with data.change_git_dir('.'):
+        yield tmp_path
+        data.clear_ref_cache()
+
+
+@pytest.fixture
+def ugit():
+    # Runs the CLI in a fresh interpreter, like a user would
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [PACKAGE_ROOT, env.get('PYTHONPATH')]))
+    env.pop('UGIT_TRACE', None)
+
+    def run(cwd, *args, input=None, check=True):
+        proc = subprocess.run(
+            [sys.executable, '-m', 'ugit.cli', *args],
+            cwd=cwd, env=env, input=input, capture_output=True,
+        )
+        if check:
+            assert proc.returncode == 0, proc.stderr.decode()
+        return proc
+    return run
@@ -0,0 +1,36 @@
+import pytest
+
+from ugit import base
+from ugit import data
+
+
+def test_cached_object_is_not_seen_from_another_repo(repo, tmp_path):
+    oid = data.hash_object(b'only here\n')
+    assert data.get_object(oid) == b'only here\n'
+
+    other = tmp_path / 'other'
+    other.mkdir()
+    with data.change_git_dir(str(other)):
+        with pytest.raises(Exception):
+            data.get_object(oid)
+
+
+def test_parsed_tree_is_charged_per_entry(repo):
+    for i in range(50):
+        (repo / f"file{i}").write_bytes(b'x')
+    base.add([f"file{i}" for i in range(50)])
+    tree = base.write_tree()
+    before = data.object_cache.size
+
+    entries = list(base._iter_tree_entries(tree))
+
+    assert len(entries) == 50
+    assert data.object_cache.size - before >= 50 * base.PARSED_TREE_ENTRY_SIZE
+
+
+def test_parsed_commit_is_cached(repo):
+    (repo / 'a').write_bytes(b'a')
+    base.add(['a'])
+    oid = base.commit('first')
+
+    assert base.get_commit(oid) is base.get_commit(oid)
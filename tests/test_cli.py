@@ -0,0 +1,60 @@
+import os
+import sys
+import subprocess
+
+
+def test_importing_cli_leaves_rich_importable():
+    code = "import sys; sys.argv = ['ugit', 'status']; import ugit.cli; import rich"
+    proc = subprocess.run([sys.executable, '-c', code], capture_output=True)
+    assert proc.returncode == 0, proc.stderr.decode()
+
+
+
+def _object_exists(repo, oid):
+    return (repo / '.ugit' / 'objects' / oid[:2] / oid[2:]).exists()
+
+def test_hash_object_writes_unless_no_write(tmp_path, ugit):
+    ugit(tmp_path, 'init')
+    (tmp_path / 'file').write_bytes(b'content\n')
+
+    oid = ugit(tmp_path, 'hash-object', '--no-write', 'file').stdout.strip().decode()
+    assert not _object_exists(tmp_path, oid)
+    assert ugit(tmp_path, 'hash-object', 'file').stdout.strip().decode() == oid
+    assert ugit(tmp_path, 'cat-file', oid).stdout == b'content\n'
+
+def test_hash_object_stdin_paths_writes_only_with_w(tmp_path, ugit):
+    ugit(tmp_path, 'init')
+    (tmp_path / 'file').write_bytes(b'content\n')
+
+    oid = ugit(tmp_path, 'hash-object', '--stdin-paths', input=b'file\n').stdout.strip().decode()
+    assert not _object_exists(tmp_path, oid)
+    ugit(tmp_path, 'hash-object', '--stdin-paths', '-w', input=b'file\n')
+    assert _object_exists(tmp_path, oid)
+
+def test_hash_object_stdin_paths_with_non_utf8_names(tmp_path, ugit):
+    ugit(tmp_path, 'init')
+    name = b'caf\xe9'
+    with open(os.path.join(os.fsencode(str(tmp_path)), name), 'wb') as f:
+        f.write(b'content\n')
+    (tmp_path / 'other').write_bytes(b'other\n')
+
+    oids = ugit(tmp_path, 'hash-object', '--stdin-paths', '-w', input=name + b'\nother\n').stdout.split()
+
+    assert oids == [ugit(tmp_path, 'hash-object', path).stdout.strip() for path in (os.fsdecode(name), 'other')]
+    assert all(_object_exists(tmp_path, oid.decode()) for oid in oids)
+
+def test_cat_file_batch_reports_missing_and_keeps_going(tmp_path, ugit):
+    ugit(tmp_path, 'init')
+    (tmp_path / 'file').write_bytes(b'content\n')
+    oid = ugit(tmp_path, 'hash-object', '-w', 'file').stdout.strip()
+    unknown = b'0' * 40
+    names = [unknown, b'\xff\xfe', b'no-such-ref', oid]
+
+    out = ugit(tmp_path, 'cat-file', '--batch', input=b'\n'.join(names) + b'\n').stdout
+
+    assert out == (
+        unknown + b' missing\n' +
+        b'\xff\xfe missing\n' +
+        b'no-such-ref missing\n' +
+        oid + b' blob 8\ncontent\n\n'
+    )
@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+from ugit import _delta
+
+
+def _round_trip(base, target):
+    delta = _delta.create_delta(base, target)
+    assert _delta.apply_delta(base, delta) == target
+    return delta
+
+def test_delta_random_edits():
+    rng = random.Random(1)
+    for _ in range(200):
+        base = bytes(rng.randrange(4) for _ in range(rng.randrange(0, 2000)))
+        target = bytearray(base)
+        for _ in range(rng.randrange(5)):
+            at = rng.randrange(len(target) + 1)
+            target[at:at + rng.randrange(50)] = bytes(rng.randrange(4) for _ in range(rng.randrange(50)))
+        _round_trip(base, bytes(target))
+
+@pytest.mark.parametrize('base, target', [
+    (b'', b''),
+    (b'', b'some content that is not in the base'),
+    (b'some content that is not in the target', b''),
+    (b'short', b'short'),
+    (b'x' * 1000, b'x' * 1000),
+    (bytes(range(256)) * 4, bytes(range(256)) * 4),
+])
+def test_delta_edge_cases(base, target):
+    _round_trip(base, target)
+
+def test_delta_of_identical_input_is_small():
+    content = bytes(random.Random(2).randrange(256) for _ in range(10000))
+    assert len(_round_trip(content, content)) < 16
+
+def test_delta_max_size():
+    rng = random.Random(3)
+    base = bytes(rng.randrange(256) for _ in range(1000))
+    target = bytes(rng.randrange(256) for _ in range(1000))
+    assert _delta.DeltaIndex(base).delta(target, max_size=100) is None
+
+def test_delta_probe_of_large_targets():
+    rng = random.Random(4)
+    base = bytes(rng.randrange(256) for _ in range(_delta.PROBE_MIN_SIZE * 2))
+    edited = base[:1000] + b'edit' + base[1000:]
+    unrelated = bytes(rng.randrange(256) for _ in range(len(base)))
+
+    assert _delta.apply_delta(base, _delta.create_delta(base, edited)) == edited
+    assert _delta.DeltaIndex(base).delta(unrelated) is None
+
+def test_varint_round_trip():
+    for value in (0, 1, 0x7f, 0x80, 0x3fff, 0x4000, 2 ** 32, 2 ** 63):
+        encoded = _delta._encode_varint(value)
+        assert _delta._decode_varint(encoded, 0) == (value, len(encoded))
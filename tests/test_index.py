@@ -0,0 +1,119 @@
+import os
+
+import pytest
+
+from ugit import base
+from ugit import data
+from ugit import _index
+
+
+def _entries():
+    return {
+        'a.txt': _index.IndexEntry('1' * 40, 1_700_000_000_123_456_789, 3, 42, 0o100644),
+        'dir/b.txt': _index.IndexEntry('2' * 40, 1_700_000_001_000_000_000, 0, 43, 0o100755),
+        'dir/sub/c': _index.IndexEntry('3' * 40, 0, 2 ** 40, 2 ** 63, 0o100644),
+        'ünïcode': _index.IndexEntry('4' * 40, -1, 1, 1, 0o100644),
+    }
+
+
+def test_index_round_trip(tmp_path):
+    path = str(tmp_path / 'index')
+    entries = _entries()
+    _index.write(path, entries)
+
+    index = _index.Index(path)
+    try:
+        assert len(index) == len(entries)
+        assert list(index) == sorted(entries, key=os.fsencode)
+        assert dict(index.items()) == entries
+        for name, entry in entries.items():
+            assert name in index
+            assert index[name] == entry
+        assert 'dir' not in index
+        assert 'missing' not in index
+        with pytest.raises(KeyError):
+            index['missing']
+        assert not index.dirty
+    finally:
+        index.close()
+
+def test_index_changes_are_written_back(tmp_path):
+    path = str(tmp_path / 'index')
+    _index.write(path, _entries())
+
+    index = _index.Index(path)
+    index['a.txt'] = index['a.txt']
+    assert not index.dirty
+    index['new'] = _index.IndexEntry('5' * 40, 1, 2, 3, 0o100644)
+    del index['dir/b.txt']
+    assert index.dirty
+    index.write()
+
+    expected = _entries()
+    expected['new'] = _index.IndexEntry('5' * 40, 1, 2, 3, 0o100644)
+    del expected['dir/b.txt']
+    index = _index.Index(path)
+    try:
+        assert dict(index.items()) == expected
+    finally:
+        index.close()
+
+def test_missing_and_empty_index(tmp_path):
+    assert len(_index.Index(str(tmp_path / 'missing'))) == 0
+    _index.write(str(tmp_path / 'empty'), {})
+    index = _index.Index(str(tmp_path / 'empty'))
+    try:
+        assert len(index) == 0
+        assert list(index.items()) == []
+    finally:
+        index.close()
+
+def test_corrupt_index_is_rejected(tmp_path):
+    path = str(tmp_path / 'index')
+    _index.write(path, _entries())
+    with open(path, 'r+b') as f:
+        f.seek(_index.HEADER.size)
+        f.write(b'\xff')
+    with pytest.raises(AssertionError):
+        _index.Index(path)
+
+def test_json_index_is_read_and_rewritten(tmp_path):
+    path = str(tmp_path / 'index')
+    with open(path, 'w') as f:
+        f.write('{"a": ["%s", 1, 2, 3, 4], "b": "%s"}' % ('1' * 40, '2' * 40))
+
+    index = _index.Index(path)
+    assert index['a'] == _index.IndexEntry('1' * 40, 1, 2, 3, 4)
+    assert index['b'] == _index.IndexEntry('2' * 40, 0, 0, 0, 0)
+    assert index.dirty
+
+
+def _set_mtime(path, mtime_ns):
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+def test_file_changed_in_the_same_tick_as_the_index_is_rehashed(repo):
+    base.init()
+    (repo / 'file').write_bytes(b'one')
+    base.add(['file'])
+    mtime_ns = os.stat('file').st_mtime_ns
+
+    # Same size, inode and mtime as what the index recorded, and the index
+    # was written within the same timestamp tick
+    with open('file', 'r+b') as f:
+        f.write(b'two')
+    _set_mtime('file', mtime_ns)
+    _set_mtime(f"{data.GIT_DIR}/index", mtime_ns)
+
+    assert base.get_working_tree()['file'] == data.hash_object(b'two', write=False)
+
+def test_clean_file_is_not_rehashed(repo, monkeypatch):
+    base.init()
+    (repo / 'file').write_bytes(b'one')
+    base.add(['file'])
+    _set_mtime(f"{data.GIT_DIR}/index", os.stat('file').st_mtime_ns + 1_000_000_000)
+
+    def hash_file(path, write=True):
+        raise AssertionError(f"{path} was rehashed")
+    monkeypatch.setattr(data, 'hash_file', hash_file)
+
+    assert base.get_working_tree()['file'] == data.hash_object(b'one', write=False)
@@ -0,0 +1,134 @@
+import re
+import random
+
+import pytest
+
+from ugit import _linediff
+
+ALGORITHMS = sorted(_linediff.ALGORITHMS)
+HUNK = re.compile(r'@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+
+def _apply(a, diff):
+    # Rebuilds the new lines from the old ones and the unified diff, checking
+    # every context and removed line against the old ones
+    out = []
+    pos = 0
+    lines = list(diff)
+    if lines:
+        assert lines[0].startswith('--- ') and lines[1].startswith('+++ ')
+    for line in lines[2:]:
+        match = HUNK.fullmatch(line)
+        if match:
+            start, length = int(match[1]), int(match[2] or 1)
+            start = start if length == 0 else start - 1
+            assert start >= pos
+            out.extend(a[pos:start])
+            pos = start
+        elif line[0] == '+':
+            out.append(line[1:])
+        else:
+            assert line[0] in ' -' and a[pos] == line[1:]
+            if line[0] == ' ':
+                out.append(a[pos])
+            pos += 1
+    out.extend(a[pos:])
+    return out
+
+def _edit(rng, lines, alphabet):
+    lines = list(lines)
+    for _ in range(rng.randrange(6)):
+        at = rng.randrange(len(lines) + 1)
+        lines[at:at + rng.randrange(4)] = [rng.choice(alphabet) for _ in range(rng.randrange(4))]
+    return lines
+
+def _check_blocks(a, b, blocks):
+    assert blocks[-1] == (len(a), len(b), 0)
+    i = j = 0
+    for ai, bj, n in blocks:
+        assert ai >= i and bj >= j
+        assert a[ai:ai + n] == b[bj:bj + n]
+        i, j = ai + n, bj + n
+
+def _lcs(a, b):
+    row = [0] * (len(b) + 1)
+    for x in a:
+        previous = 0
+        for j, y in enumerate(b):
+            previous, row[j + 1] = row[j + 1], previous + 1 if x == y else max(row[j + 1], row[j])
+    return row[-1]
+
+
+@pytest.mark.parametrize('algorithm', ALGORITHMS)
+@pytest.mark.parametrize('context', [0, 1, 3])
+def test_diff_applies_to_old_text(algorithm, context):
+    rng = random.Random(context)
+    alphabet = ['a', 'b', 'c', '', '}', 'x = 1', 'return']
+    for _ in range(300):
+        a = [rng.choice(alphabet) for _ in range(rng.randrange(30))]
+        b = _edit(rng, a, alphabet)
+        diff = list(_linediff.unified_diff(a, b, 'a/f', 'b/f', n=context, algorithm=algorithm))
+        assert _apply(a, diff) == b
+
+@pytest.mark.parametrize('algorithm', ALGORITHMS)
+def test_matching_blocks_match(algorithm):
+    rng = random.Random(1)
+    for _ in range(300):
+        a = [rng.choice('abcd') for _ in range(rng.randrange(40))]
+        b = _edit(rng, a, 'abcd')
+        _check_blocks(a, b, _linediff.matching_blocks(a, b, algorithm))
+
+def test_myers_finds_longest_common_subsequence():
+    rng = random.Random(2)
+    for _ in range(300):
+        a = [rng.choice('abc') for _ in range(rng.randrange(25))]
+        b = [rng.choice('abc') for _ in range(rng.randrange(25))]
+        blocks = _linediff.matching_blocks(a, b, 'myers')
+        assert sum(n for _, _, n in blocks) == _lcs(a, b)
+
+@pytest.mark.parametrize('algorithm', ALGORITHMS)
+def test_large_inputs_past_max_cost(algorithm):
+    rng = random.Random(3)
+    a = [str(rng.randrange(1000)) for _ in range(5000)]
+    b = [str(rng.randrange(1000)) for _ in range(5000)]
+    blocks = _linediff.matching_blocks(a, b, algorithm)
+    _check_blocks(a, b, blocks)
+    assert _apply(a, _linediff.unified_diff(a, b, algorithm=algorithm)) == b
+
+@pytest.mark.parametrize('algorithm', ALGORITHMS)
+@pytest.mark.parametrize('a, b', [
+    ([], []),
+    ([], ['one', 'two']),
+    (['one', 'two'], []),
+    (['same', 'lines'], ['same', 'lines']),
+])
+def test_empty_and_identical(algorithm, a, b):
+    diff = list(_linediff.unified_diff(a, b, 'a/f', 'b/f', algorithm=algorithm))
+    if a == b:
+        assert diff == []
+    else:
+        assert _apply(a, diff) == b
+
+def test_empty_file_hunk_ranges():
+    assert list(_linediff.unified_diff([], ['one', 'two'], 'a/f', 'b/f')) == [
+        '--- a/f', '+++ b/f', '@@ -0,0 +1,2 @@', '+one', '+two',
+    ]
+    assert list(_linediff.unified_diff(['one'], [], 'a/f', 'b/f')) == [
+        '--- a/f', '+++ b/f', '@@ -1 +0,0 @@', '-one',
+    ]
+
+@pytest.mark.parametrize('algorithm', ALGORITHMS)
+def test_no_trailing_newline(algorithm):
+    # Lines kept with their ends: only the last line lost its newline
+    a = 'one\ntwo\nthree\n'.splitlines(keepends=True)
+    b = 'one\ntwo\nthree'.splitlines(keepends=True)
+    diff = list(_linediff.unified_diff(a, b, 'a/f', 'b/f', algorithm=algorithm))
+    assert diff[2:] == ['@@ -1,3 +1,3 @@', ' one\n', ' two\n', '-three\n', '+three']
+    assert _apply(a, diff) == b
+    assert _apply(b, _linediff.unified_diff(b, a, algorithm=algorithm)) == a
+
+def test_histogram_anchors_on_rare_lines():
+    a = ['def f():', '    pass', '', 'def g():', '    pass', '']
+    b = ['def g():', '    pass', '']
+    diff = list(_linediff.unified_diff(a, b, n=0, algorithm='histogram'))
+    assert diff[2:] == ['@@ -1,3 +0,0 @@', '-def f():', '-    pass', '-']
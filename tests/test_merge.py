@@ -0,0 +1,57 @@
+from ugit import base
+from ugit import data
+
+
+def _tree(files):
+    with data.get_index() as index:
+        index.clear()
+        index.update({path: data.index_entry(data.hash_object(content)) for path, content in files.items()})
+    return base.write_tree()
+
+def _merge(base_files, HEAD_files, other_files):
+    tree, conflicts = base.merge_trees(_tree(base_files), _tree(HEAD_files), _tree(other_files))
+    contents = {path: data.get_object(oid) for path, oid in tree.items()}
+    return contents, [(conflict.path, conflict.kind) for conflict in conflicts]
+
+
+def test_changes_on_both_sides_are_merged(repo):
+    base_files = {'a': b'1\n2\n3\n4\n5\n', 'same': b'same\n', 'dir/b': b'b\n'}
+    HEAD_files = dict(base_files, a=b'one\n2\n3\n4\n5\n', **{'dir/c': b'c\n'})
+    other_files = {'a': b'1\n2\n3\n4\nfive\n', 'same': b'same\n', 'dir/b': b'B\n'}
+
+    contents, conflicts = _merge(base_files, HEAD_files, other_files)
+
+    assert contents == {'a': b'one\n2\n3\n4\nfive\n', 'same': b'same\n', 'dir/b': b'B\n', 'dir/c': b'c\n'}
+    assert conflicts == []
+
+def test_conflicting_changes(repo):
+    contents, conflicts = _merge(
+        {'a': b'base\n', 'gone': b'x\n'},
+        {'a': b'ours\n', 'gone': b'changed\n', 'new': b'ours\n'},
+        {'a': b'theirs\n', 'new': b'theirs\n'},
+    )
+
+    assert sorted(conflicts) == [('a', 'content'), ('gone', 'modify/delete'), ('new', 'add/add')]
+    assert contents['gone'] == b'changed\n'
+    assert b'ours' in contents['a'] and b'theirs' in contents['a']
+
+def test_file_replaced_by_a_directory_on_both_sides(repo):
+    contents, conflicts = _merge(
+        {'x': b'file\n'},
+        {'x/a': b'a\n', 'x/same': b'same\n'},
+        {'x/b': b'b\n', 'x/same': b'same\n'},
+    )
+
+    assert contents == {'x/a': b'a\n', 'x/b': b'b\n', 'x/same': b'same\n'}
+    assert conflicts == []
+
+def test_file_replaced_by_different_files_in_a_directory(repo):
+    contents, conflicts = _merge({'x': b'file\n'}, {'x/a': b'ours\n'}, {'x/a': b'theirs\n'})
+
+    assert conflicts == [('x/a', 'add/add')]
+
+def test_file_against_directory_conflicts(repo):
+    contents, conflicts = _merge({'x': b'file\n'}, {'x': b'changed\n'}, {'x/a': b'a\n'})
+
+    assert conflicts == [('x', 'file/directory')]
+    assert contents == {'x': b'changed\n'}
@@ -0,0 +1,108 @@
+import io
+import random
+import hashlib
+
+import pytest
+
+from ugit import _pack
+
+
+def _objects(count, seed=0):
+    # Versions of a few files, so that most of them are stored as deltas
+    rng = random.Random(seed)
+    files = [bytes(rng.randrange(256) for _ in range(rng.randrange(100, 3000))) for _ in range(4)]
+    objects = {}
+    for i in range(count):
+        content = bytearray(files[i % len(files)])
+        for _ in range(rng.randrange(1, 4)):
+            at = rng.randrange(len(content))
+            content[at:at + rng.randrange(20)] = bytes(rng.randrange(256) for _ in range(rng.randrange(20)))
+        files[i % len(files)] = bytes(content)
+        obj = b'blob\x00' + bytes(content)
+        objects[hashlib.sha1(obj).hexdigest()] = obj
+    objects[hashlib.sha1(b'blob\x00').hexdigest()] = b'blob\x00'
+    return objects
+
+def _load_only_pack(pack_dir):
+    packs = _pack.load_packs(str(pack_dir))
+    assert len(packs) == 1
+    return packs[0]
+
+
+@pytest.mark.parametrize('codec', ['zlib', 'none'])
+def test_pack_round_trip(tmp_path, codec):
+    objects = _objects(60)
+    _pack.write_pack(str(tmp_path), objects, objects.__getitem__, codec=codec)
+
+    pack = _load_only_pack(tmp_path)
+    try:
+        assert pack.count == len(objects)
+        assert sorted(pack.iter_oids()) == sorted(objects)
+        for oid, obj in objects.items():
+            assert pack.read(oid) == obj
+    finally:
+        pack.close()
+
+def test_pack_stores_deltas(tmp_path):
+    objects = _objects(60)
+    _pack.write_pack(str(tmp_path), objects, objects.__getitem__)
+    pack = _load_only_pack(tmp_path)
+    try:
+        kinds = {pack._pack[pack._find(oid)[0]] for oid in objects}
+    finally:
+        pack.close()
+    assert kinds == {_pack.OBJ_FULL, _pack.OBJ_REF_DELTA}
+
+def test_pack_stream_round_trip(tmp_path):
+    objects = _objects(30)
+    stream = io.BytesIO()
+    _pack.write_pack_stream(stream, objects, objects.__getitem__)
+    stream.seek(0)
+    _pack.store_pack_stream(str(tmp_path), stream)
+
+    pack = _load_only_pack(tmp_path)
+    try:
+        for oid, obj in objects.items():
+            assert pack.read(oid) == obj
+    finally:
+        pack.close()
+
+def test_empty_pack_stream_stores_nothing(tmp_path):
+    stream = io.BytesIO()
+    _pack.write_pack_stream(stream, [], None)
+    stream.seek(0)
+    assert _pack.store_pack_stream(str(tmp_path / 'pack'), stream) is None
+    assert _pack.load_packs(str(tmp_path / 'pack')) == []
+
+def test_fanout_lookups(tmp_path):
+    objects = _objects(200)
+    _pack.write_pack(str(tmp_path), objects, objects.__getitem__)
+    oids = sorted(objects)
+
+    pack = _load_only_pack(tmp_path)
+    try:
+        assert pack.position(oids[0]) == 0
+        assert pack.position(oids[-1]) == len(oids) - 1
+        assert pack.oid_at(0) == oids[0]
+        assert pack.oid_at(len(oids) - 1) == oids[-1]
+        for position, oid in enumerate(oids):
+            assert pack.position(oid) == position
+        for oid in ('00' * 20, 'ff' * 20):
+            assert oid not in pack
+            assert pack.read(oid) is None
+        assert list(pack.iter_prefix(oids[-1][:2])) == [oid for oid in oids if oid.startswith(oids[-1][:2])]
+    finally:
+        pack.close()
+
+
+def test_small_pack_stream_is_unpacked(tmp_path):
+    objects = _objects(30)
+    stream = io.BytesIO()
+    _pack.write_pack_stream(stream, objects, objects.__getitem__)
+    stream.seek(0)
+    written = {}
+
+    assert _pack.store_pack_stream(str(tmp_path), stream, len(objects) + 1, written.__setitem__) is None
+
+    assert written == objects
+    assert _pack.load_packs(str(tmp_path)) == []
@@ -0,0 +1,45 @@
+import os
+
+from ugit import data
+
+
+OID1 = '1' * 40
+OID2 = '2' * 40
+
+
+def test_ref_updated_through_another_path_is_seen(repo):
+    data.update_ref('refs/heads/master', data.RefValue(symbolic=False, value=OID1))
+    assert data.get_ref('refs/heads/master').value == OID1
+
+    with data.change_git_dir(str(repo)):
+        data.update_ref('refs/heads/master', data.RefValue(symbolic=False, value=OID2))
+
+    assert data.get_ref('refs/heads/master').value == OID2
+
+
+def test_ref_written_by_another_process_is_seen(repo):
+    data.update_ref('refs/heads/master', data.RefValue(symbolic=False, value=OID1))
+    assert data.get_ref('refs/heads/master').value == OID1
+
+    path = f"{data.GIT_DIR}/refs/heads/master"
+    with open(path, 'w') as f:
+        f.write(OID2 + '\n')
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+
+    assert data.get_ref('refs/heads/master').value == OID2
+
+
+def test_packed_refs_and_loose_override(repo):
+    data.update_ref('refs/heads/master', data.RefValue(symbolic=False, value=OID1))
+    data.update_ref('refs/tags/v1', data.RefValue(symbolic=False, value=OID1))
+    assert data.pack_refs() == 2
+    assert not os.path.exists(f"{data.GIT_DIR}/refs/heads/master")
+    assert data.get_ref('refs/heads/master').value == OID1
+
+    data.update_ref('refs/heads/master', data.RefValue(symbolic=False, value=OID2))
+
+    assert data.get_ref('refs/heads/master').value == OID2
+    assert dict((name, ref.value) for name, ref in data.iter_refs('refs/')) == {
+        'refs/heads/master': OID2, 'refs/tags/v1': OID1,
+    }
@@ -0,0 +1,115 @@
+import io
+import os
+
+import orjson
+
+from ugit import base
+from ugit import data
+from ugit import _transport
+
+
+def _init_with_commit(ugit, path, name):
+    path.mkdir()
+    ugit(path, 'init')
+    (path / name).write_text(name)
+    ugit(path, 'add', name)
+    ugit(path, 'commit', '-m', name)
+
+
+def test_push_rejects_remote_commit_we_lack(tmp_path, ugit):
+    remote = tmp_path / 'remote'
+    local = tmp_path / 'local'
+    _init_with_commit(ugit, remote, 'theirs')
+    _init_with_commit(ugit, local, 'ours')
+
+    proc = ugit(local, 'push', str(remote), 'master', check=False)
+
+    assert proc.returncode != 0
+    assert b'AssertionError' in proc.stderr
+    assert b'FileNotFoundError' not in proc.stderr
+
+
+def test_push_fast_forward(tmp_path, ugit):
+    remote = tmp_path / 'remote'
+    local = tmp_path / 'local'
+    _init_with_commit(ugit, remote, 'first')
+    local.mkdir()
+    ugit(local, 'init')
+    ugit(local, 'fetch', str(remote))
+    ugit(local, 'checkout', 'refs/remote/master')
+    ugit(local, 'branch', 'master')
+    ugit(local, 'checkout', 'master')
+    (local / 'second').write_text('second')
+    ugit(local, 'add', 'second')
+    ugit(local, 'commit', '-m', 'second')
+
+    ugit(local, 'push', str(remote), 'master')
+
+    assert ugit(remote, 'log').stdout.count(b'commit ') == 2
+
+
+def _promisor(path):
+    return os.path.exists(path / '.ugit' / 'promisor')
+
+def test_push_from_partial_clone_sends_promised_blobs(tmp_path, ugit):
+    remote = tmp_path / 'remote'
+    local = tmp_path / 'local'
+    empty = tmp_path / 'empty'
+    remote.mkdir()
+    ugit(remote, 'init')
+    for name in ('a', 'b', 'c'):
+        (remote / name).write_text(name)
+    ugit(remote, 'add', 'a', 'b', 'c')
+    ugit(remote, 'commit', '-m', 'files')
+    for path in (local, empty):
+        path.mkdir()
+        ugit(path, 'init')
+    ugit(local, 'fetch', '--filter=blob:none', str(remote))
+    assert _promisor(local)
+    ugit(local, 'branch', 'master', '--start-point', 'refs/remote/master')
+    ugit(local, 'repack')
+
+    ugit(local, 'push', str(empty), 'master')
+
+    ugit(empty, 'checkout', 'master')
+    assert [(empty / name).read_text() for name in ('a', 'b', 'c')] == ['a', 'b', 'c']
+    # The blobs came in one lazy fetch, stored loose
+    assert len(os.listdir(local / '.ugit' / 'objects' / 'pack')) == 2
+
+def test_failed_filtered_fetch_is_no_partial_clone(tmp_path, ugit):
+    local = tmp_path / 'local'
+    local.mkdir()
+    ugit(local, 'init')
+
+    proc = ugit(local, 'fetch', '--filter=blob:none', str(tmp_path / 'missing'), check=False)
+
+    assert proc.returncode != 0
+    assert not _promisor(local)
+
+def test_server_rejects_push_missing_objects(tmp_path, monkeypatch):
+    client = tmp_path / 'client'
+    client.mkdir()
+    monkeypatch.chdir(client)
+    with data.change_git_dir('.'):
+        base.init()
+        (client / 'file').write_text('content')
+        base.add(['file'])
+        oid = base.commit('commit')
+        # The commit and its tree, but not the blob
+        objects = [oid, base.get_commit(oid).tree]
+        pack = io.BytesIO()
+        data.write_pack_stream(pack, objects)
+
+    payload = orjson.dumps({'command': 'push', 'ref': 'refs/heads/master', 'old': None, 'new': oid})
+    request = _transport.FRAME.pack(len(payload)) + payload + pack.getvalue()
+    server = tmp_path / 'server'
+    server.mkdir()
+    monkeypatch.chdir(server)
+    with data.change_git_dir('.'):
+        base.init()
+        reply = io.BytesIO()
+        _transport.serve(io.BytesIO(request), reply)
+        assert data.get_ref('refs/heads/master').value is None
+
+    response = _transport.Connection(io.BytesIO(reply.getvalue()), io.BytesIO()).recv()
+    assert 'missing objects' in response['error']
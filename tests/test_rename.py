@@ -0,0 +1,123 @@
+import hashlib
+
+from ugit import _rename
+
+
+def _lines(count, prefix='line'):
+    return b''.join(b'%s %d of the file\n' % (prefix.encode(), i) for i in range(count))
+
+class Contents:
+    # Blobs by made up oid, read the way the diff code reads them
+
+    def __init__(self):
+        self.blobs = {}
+
+    def add(self, content):
+        oid = hashlib.sha1(content).hexdigest()
+        self.blobs[oid] = content
+        return oid
+
+    def read(self, path, oid):
+        return self.blobs[oid]
+
+    def find_renames(self, changes, **kwargs):
+        return _rename.find_renames(changes, self.read, self.read, **kwargs)
+
+def _with_changed_lines(content, changed):
+    lines = content.splitlines(keepends=True)
+    for i in range(changed):
+        lines[i] = b'changed %d\n' % i
+    return b''.join(lines)
+
+
+def test_exact_rename():
+    contents = Contents()
+    oid = contents.add(_lines(10))
+    other = contents.add(b'other\n')
+    changes = [('new/name', None, oid), ('old/name', oid, None), ('unrelated', other, None)]
+
+    assert contents.find_renames(changes) == [
+        _rename.Rename('old/name', 'new/name', oid, oid, 100, False),
+        ('unrelated', other, None),
+    ]
+
+def test_exact_rename_prefers_the_same_name():
+    contents = Contents()
+    oid = contents.add(_lines(10))
+    changes = [('a/file', oid, None), ('b/other', oid, None), ('c/file', None, oid)]
+
+    result = contents.find_renames(changes)
+
+    assert result[1] == _rename.Rename('a/file', 'c/file', oid, oid, 100, False)
+
+def test_similar_rename_above_threshold():
+    contents = Contents()
+    old = contents.add(_lines(10))
+    new = contents.add(_with_changed_lines(_lines(10), 2))
+
+    result = contents.find_renames([('a', old, None), ('b', None, new)])
+
+    assert len(result) == 1
+    rename = result[0]
+    assert (rename.old_path, rename.path, rename.copy) == ('a', 'b', False)
+    assert _rename.THRESHOLD <= rename.similarity < 100
+
+def test_similar_rename_below_threshold():
+    contents = Contents()
+    old = contents.add(_lines(10))
+    new = contents.add(_with_changed_lines(_lines(10), 8))
+    changes = [('a', old, None), ('b', None, new)]
+
+    assert contents.find_renames(changes) == changes
+
+def test_threshold_decides_between_the_two():
+    contents = Contents()
+    old = contents.add(_lines(10))
+    new = contents.add(_with_changed_lines(_lines(10), 3))
+    changes = [('a', old, None), ('b', None, new)]
+    similarity = contents.find_renames(changes, threshold=1)[0].similarity
+
+    assert isinstance(contents.find_renames(changes, threshold=similarity)[0], _rename.Rename)
+    assert contents.find_renames(changes, threshold=similarity + 1) == changes
+
+def test_best_source_wins():
+    contents = Contents()
+    close = contents.add(_with_changed_lines(_lines(20), 1))
+    far = contents.add(_with_changed_lines(_lines(20), 8))
+    new = contents.add(_lines(20))
+    changes = [('close', close, None), ('far', far, None), ('new', None, new)]
+
+    result = contents.find_renames(changes)
+
+    assert result[1].old_path == 'close' and result[1].path == 'new'
+    assert result[0] == ('far', far, None)
+
+def test_copies_need_to_be_asked_for():
+    contents = Contents()
+    old = contents.add(_lines(10))
+    modified = contents.add(_with_changed_lines(_lines(10), 1))
+    changes = [('copy', None, old), ('source', old, modified)]
+
+    assert contents.find_renames(changes) == changes
+    assert contents.find_renames(changes, copies=True)[0] == _rename.Rename('source', 'copy', old, old, 100, True)
+
+def test_copy_of_an_unchanged_file():
+    contents = Contents()
+    oid = contents.add(_lines(10))
+    changes = [('copy', None, oid)]
+    old_tree = {'source': oid}
+
+    assert contents.find_renames(changes, copies=True) == changes
+    assert contents.find_renames(changes, copies=True, old_tree=old_tree) == [
+        _rename.Rename('source', 'copy', oid, oid, 100, True),
+    ]
+
+def test_rename_and_copy_of_one_source():
+    contents = Contents()
+    oid = contents.add(_lines(10))
+    changes = [('a', None, oid), ('b', None, oid), ('old', oid, None)]
+
+    assert contents.find_renames(changes, copies=True) == [
+        _rename.Rename('old', 'a', oid, oid, 100, False),
+        _rename.Rename('old', 'b', oid, oid, 100, True),
+    ]
@@ -0,0 +1,77 @@
+import io
+import socket
+import threading
+import time
+
+import orjson
+
+from ugit import base
+from ugit import _transport
+
+
+def _frames(*messages):
+    out = b''
+    for message in messages:
+        payload = orjson.dumps(message)
+        out += _transport.FRAME.pack(len(payload)) + payload
+    return out
+
+def _serve(*messages):
+    writer = io.BytesIO()
+    _transport.serve(io.BytesIO(_frames(*messages)), writer)
+    return _transport.Connection(io.BytesIO(writer.getvalue()), io.BytesIO())
+
+def _commit(repo, name):
+    (repo / name).write_text(name)
+    base.add([name])
+    return base.commit(name)
+
+
+def test_server_reports_errors_and_keeps_serving(repo):
+    base.init()
+    oid = _commit(repo, 'a')
+
+    replies = _serve(
+        {'command': 'unknown'},
+        {'command': 'fetch-objects', 'oids': ['0' * 40]},
+        {'no command': True},
+        {'command': 'ls-refs', 'prefix': 'refs/heads/'},
+    )
+
+    assert replies.recv() == {'error': 'Unknown command unknown'}
+    assert 'Unknown objects' in replies.recv()['error']
+    assert replies.recv()['error'].startswith('KeyError')
+    assert replies.recv() == {'refs': {'refs/heads/master': oid}}
+    assert replies.recv() is None
+
+
+def test_server_sees_packs_written_by_another_process(repo, ugit):
+    base.init()
+    first = _commit(repo, 'a')
+    ugit(repo, 'repack')
+    _serve({'command': 'have', 'haves': [first]})
+
+    second = _commit(repo, 'b')
+    ugit(repo, 'repack')
+    replies = _serve({'command': 'have', 'haves': [first, second]})
+
+    assert replies.recv() == {'common': [first, second]}
+
+
+def test_socket_server_replaces_a_stale_socket(repo):
+    base.init()
+    oid = _commit(repo, 'a')
+    path = str(repo / 'sock')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+        stale.bind(path)
+
+    threading.Thread(target=_transport.serve_socket, args=(path,), daemon=True).start()
+    for _ in range(100):
+        try:
+            with _transport.connect(_transport.SOCKET_PREFIX + path) as connection:
+                assert _transport.ls_refs(connection, 'refs/heads/') == {'refs/heads/master': oid}
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.01)
+    else:
+        assert False, 'server never listened'
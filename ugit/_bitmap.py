@@ -0,0 +1,61 @@
+import os
+import zlib
+import struct
+
+SIGNATURE = b'UBMP'
+VERSION = 1
+
+HEADER = struct.Struct('>4sII')
+# commit oid, size of its compressed bitmap
+ENTRY = struct.Struct('>20sI')
+
+# A bitmap is a Python int whose bit n is set when the object at position n
+# of the pack index is reachable. It is stored as its little-endian bytes run
+# through zlib, which collapses the long runs of zero or one bytes that
+# reachability bitmaps are made of.
+
+
+def write(path, bitmaps):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(SIGNATURE, VERSION, len(bitmaps)))
+        for oid, bits in sorted(bitmaps.items()):
+            compressed = zlib.compress(bits.to_bytes((bits.bit_length() + 7) // 8, 'little'))
+            f.write(ENTRY.pack(bytes.fromhex(oid), len(compressed)))
+            f.write(compressed)
+    os.replace(tmp_path, path)
+
+
+class Bitmaps:
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            content = f.read()
+        signature, version, count = HEADER.unpack_from(content)
+        assert signature == SIGNATURE, f"Bad bitmap file {path}"
+        assert version == VERSION, f"Unsupported bitmap version {version}"
+        self._compressed = {}
+        self._bitmaps = {}
+        pos = HEADER.size
+        for _ in range(count):
+            oid, size = ENTRY.unpack_from(content, pos)
+            pos += ENTRY.size
+            self._compressed[oid.hex()] = content[pos:pos + size]
+            pos += size
+
+    def get(self, oid):
+        bits = self._bitmaps.get(oid)
+        if bits is None and oid in self._compressed:
+            bits = self._bitmaps[oid] = int.from_bytes(zlib.decompress(self._compressed[oid]), 'little')
+        return bits
+
+    def __len__(self):
+        return len(self._compressed)
+
+
+def iter_positions(bits):
+    for i, byte in enumerate(bits.to_bytes((bits.bit_length() + 7) // 8, 'little')):
+        while byte:
+            low = byte & -byte
+            yield i * 8 + low.bit_length() - 1
+            byte ^= low
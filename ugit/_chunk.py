@@ -0,0 +1,57 @@
+import re
+import hashlib
+
+# Content-defined chunking: a chunk ends where the bytes just before it look
+# a certain way, so an edit only moves the boundaries next to it and the
+# chunks around are the same as in the previous version.
+#
+# Every position gets a one byte hash of the WINDOW bytes ending there,
+# the XOR of each of those bytes through a table of its own. Computing it a
+# byte at a time in Python is far too slow for large files, so it is done for
+# a whole buffer at once: translate the buffer through each table, shift it
+# by its offset and XOR them all as big integers. A chunk ends after three
+# hashes matching BOUNDARY, which happens once every 2**20 bytes of varied
+# content. Chunks are never shorter than MIN_SIZE or longer than MAX_SIZE.
+
+WINDOW = 8
+MIN_SIZE = 256 * 1024
+MAX_SIZE = 4 * 1024 * 1024
+BOUNDARY = re.compile(rb'\x00\x00[\x00-\x0f]')
+
+TABLES = [
+    bytes(hashlib.sha256(b'ugit chunk %d %d' % (offset, value)).digest()[0] for value in range(256))
+    for offset in range(WINDOW)
+]
+
+
+def iter_chunks(f):
+    # Chunks of what is read from f; only ever holds two chunks' worth of it.
+    # The boundaries only depend on the content, not on how it is read.
+    buffer = b''
+    while True:
+        data = f.read(MAX_SIZE)
+        buffer += data
+        if not buffer:
+            return
+        hashes = _hashes(buffer)
+        start = 0
+        # A boundary can only be placed once MAX_SIZE bytes past the start
+        # of the chunk are known, or the end is reached
+        while len(buffer) - start >= MAX_SIZE or (not data and start < len(buffer)):
+            end = _find_end(hashes, start)
+            yield buffer[start:end]
+            start = end
+        if not data:
+            return
+        buffer = buffer[start:]
+
+def _find_end(hashes, start):
+    limit = min(start + MAX_SIZE, len(hashes))
+    match = BOUNDARY.search(hashes, start + MIN_SIZE, limit)
+    return match.end() if match else limit
+
+def _hashes(buffer):
+    acc = int.from_bytes(buffer.translate(TABLES[0]), 'little')
+    for offset in range(1, WINDOW):
+        acc ^= int.from_bytes(buffer.translate(TABLES[offset]), 'little') << (8 * offset)
+    return acc.to_bytes(len(buffer) + WINDOW, 'little')[:len(buffer)]
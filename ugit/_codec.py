@@ -0,0 +1,35 @@
+import zlib
+import importlib.util
+
+from collections import namedtuple
+
+# magic is the prefix every compressed stream of the codec starts with, which
+# lets readers pick the codec without storing it. Stored objects that match no
+# codec are uncompressed: their "blob"/"tree"/"commit"/"chunked" header
+# can't collide.
+Codec = namedtuple('Codec', ['name', 'magic', 'compress', 'decompress'])
+
+CODECS = {}
+
+def register(codec):
+    CODECS[codec.name] = codec
+
+def compress(data, codec='zlib'):
+    return CODECS[codec].compress(data)
+
+def decompress(data):
+    for codec in CODECS.values():
+        if codec.magic and data.startswith(codec.magic):
+            return codec.decompress(data)
+    return data
+
+register(Codec('none', b'', bytes, bytes))
+register(Codec('zlib', b'\x78', zlib.compress, zlib.decompress))
+# zstandard is only imported once something is compressed or decompressed
+# with it, most commands never do
+if importlib.util.find_spec('zstandard') is not None:
+    register(Codec(
+        'zstd', b'\x28\xb5\x2f\xfd',
+        lambda data: importlib.import_module('zstandard').ZstdCompressor().compress(data),
+        lambda data: importlib.import_module('zstandard').ZstdDecompressor().decompress(data),
+    ))
@@ -0,0 +1,135 @@
+import os
+import mmap
+import struct
+
+SIGNATURE = b'UCGR'
+VERSION = 1
+
+HEADER = struct.Struct('>4sII')
+FANOUT = struct.Struct('>256I')
+# tree oid, first parent, second parent, generation
+RECORD = struct.Struct('>20sIII')
+EDGE = struct.Struct('>I')
+OID_SIZE = 20
+
+NO_PARENT = 0xffffffff
+# Set on the second parent slot of octopus merges: the remaining bits index
+# the extra edge list, whose last entry for the commit has the bit set too
+EXTRA_EDGES = 0x80000000
+
+
+def write(path, commits):
+    # commits: {oid: (tree, parents)}, closed under parents
+    oids = sorted(commits)
+    positions = {oid: i for i, oid in enumerate(oids)}
+    generations = _compute_generations(commits)
+
+    records = []
+    edges = []
+    for oid in oids:
+        tree, parents = commits[oid]
+        parents = [positions[parent] for parent in parents]
+        first = parents[0] if parents else NO_PARENT
+        if len(parents) <= 2:
+            second = parents[1] if len(parents) == 2 else NO_PARENT
+        else:
+            second = EXTRA_EDGES | len(edges)
+            edges.extend(parents[1:-1])
+            edges.append(EXTRA_EDGES | parents[-1])
+        records.append(RECORD.pack(bytes.fromhex(tree), first, second, generations[oid]))
+
+    fanout = [0] * 256
+    for oid in oids:
+        fanout[int(oid[:2], 16)] += 1
+    for i in range(1, 256):
+        fanout[i] += fanout[i - 1]
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(SIGNATURE, VERSION, len(oids)))
+        f.write(FANOUT.pack(*fanout))
+        f.write(b''.join(bytes.fromhex(oid) for oid in oids))
+        f.write(b''.join(records))
+        f.write(b''.join(EDGE.pack(edge) for edge in edges))
+    os.replace(tmp_path, path)
+    return len(oids)
+
+def _compute_generations(commits):
+    generations = {}
+    for oid in commits:
+        stack = [oid]
+        while stack:
+            top = stack[-1]
+            if top in generations:
+                stack.pop()
+                continue
+            parents = commits[top][1]
+            missing = [parent for parent in parents if parent not in generations]
+            if missing:
+                stack.extend(missing)
+                continue
+            generations[top] = 1 + max((generations[parent] for parent in parents), default=0)
+            stack.pop()
+    return generations
+
+
+class CommitGraph:
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        signature, version, self.count = HEADER.unpack_from(self._map)
+        assert signature == SIGNATURE, f"Bad commit graph {path}"
+        assert version == VERSION, f"Unsupported commit graph version {version}"
+        self._fanout = FANOUT.unpack_from(self._map, HEADER.size)
+        self._oids_start = HEADER.size + FANOUT.size
+        self._records_start = self._oids_start + self.count * OID_SIZE
+        self._edges_start = self._records_start + self.count * RECORD.size
+
+    def lookup(self, oid):
+        key = bytes.fromhex(oid)
+        lo = self._fanout[key[0] - 1] if key[0] else 0
+        hi = self._fanout[key[0]]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = self._oids_start + mid * OID_SIZE
+            current = self._map[pos:pos + OID_SIZE]
+            if current < key:
+                lo = mid + 1
+            elif current > key:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def oid(self, position):
+        pos = self._oids_start + position * OID_SIZE
+        return self._map[pos:pos + OID_SIZE].hex()
+
+    def tree(self, position):
+        return RECORD.unpack_from(self._map, self._records_start + position * RECORD.size)[0].hex()
+
+    def generation(self, position):
+        return RECORD.unpack_from(self._map, self._records_start + position * RECORD.size)[3]
+
+    def parents(self, position):
+        _, first, second, _ = RECORD.unpack_from(self._map, self._records_start + position * RECORD.size)
+        parents = []
+        if first != NO_PARENT:
+            parents.append(self.oid(first))
+        if second == NO_PARENT:
+            return parents
+        if not second & EXTRA_EDGES:
+            parents.append(self.oid(second))
+            return parents
+        edge = second & ~EXTRA_EDGES
+        while True:
+            value = EDGE.unpack_from(self._map, self._edges_start + edge * EDGE.size)[0]
+            parents.append(self.oid(value & ~EXTRA_EDGES))
+            if value & EXTRA_EDGES:
+                return parents
+            edge += 1
+
+    def close(self):
+        self._map.close()
@@ -0,0 +1,116 @@
+BLOCK_SIZE = 16
+MAX_INSERT = 0x7f
+OP_COPY = 0x80
+# Targets this large are first probed at SAMPLES places for blocks of the
+# base; an unrelated target would otherwise be scanned a byte at a time
+# until the delta grows too big, which takes seconds for a few megabytes
+PROBE_MIN_SIZE = 64 * 1024
+SAMPLES = 32
+
+
+class DeltaIndex:
+
+    def __init__(self, base):
+        self.base = base
+        self._blocks = {}
+        for offset in range(0, len(base) - BLOCK_SIZE + 1, BLOCK_SIZE):
+            self._blocks.setdefault(base[offset:offset + BLOCK_SIZE], offset)
+
+    def delta(self, target, max_size=None):
+        # Copy/insert instructions rebuilding target from base; None once the
+        # delta grows past max_size, since it wouldn't be worth storing
+        if len(target) >= PROBE_MIN_SIZE and not self._probe(target):
+            return None
+        out = bytearray(_encode_varint(len(self.base)) + _encode_varint(len(target)))
+        insert_start = 0
+        i = 0
+        end = len(target) - BLOCK_SIZE
+        while i <= end:
+            base_offset = self._blocks.get(target[i:i + BLOCK_SIZE])
+            if base_offset is None:
+                i += 1
+                continue
+            length = _match_length(self.base, base_offset, target, i)
+            _emit_insert(out, target, insert_start, i)
+            out.append(OP_COPY)
+            out += _encode_varint(base_offset)
+            out += _encode_varint(length)
+            i += length
+            insert_start = i
+            if max_size is not None and len(out) > max_size:
+                return None
+        _emit_insert(out, target, insert_start, len(target))
+        if max_size is not None and len(out) > max_size:
+            return None
+        return bytes(out)
+
+    def _probe(self, target):
+        # True when at least a quarter of the samples find a block of the
+        # base; blocks are only indexed at every BLOCK_SIZE bytes of the base,
+        # so each sample tries BLOCK_SIZE offsets
+        stride = (len(target) - 2 * BLOCK_SIZE) // SAMPLES
+        found = 0
+        for sample in range(SAMPLES):
+            start = sample * stride
+            if any(target[i:i + BLOCK_SIZE] in self._blocks for i in range(start, start + BLOCK_SIZE)):
+                found += 1
+        return found * 4 >= SAMPLES
+
+
+def create_delta(base, target):
+    return DeltaIndex(base).delta(target)
+
+def apply_delta(base, delta):
+    base_size, pos = _decode_varint(delta, 0)
+    target_size, pos = _decode_varint(delta, pos)
+    assert base_size == len(base), "Delta base size mismatch"
+    out = bytearray()
+    while pos < len(delta):
+        op = delta[pos]
+        pos += 1
+        if op == OP_COPY:
+            offset, pos = _decode_varint(delta, pos)
+            length, pos = _decode_varint(delta, pos)
+            out += base[offset:offset + length]
+        else:
+            out += delta[pos:pos + op]
+            pos += op
+    assert len(out) == target_size, "Delta target size mismatch"
+    return bytes(out)
+
+def _match_length(base, base_offset, target, target_offset):
+    limit = min(len(base) - base_offset, len(target) - target_offset)
+    length = BLOCK_SIZE
+    step = 256
+    while (length + step <= limit and
+           base[base_offset + length:base_offset + length + step] ==
+           target[target_offset + length:target_offset + length + step]):
+        length += step
+    while length < limit and base[base_offset + length] == target[target_offset + length]:
+        length += 1
+    return length
+
+def _emit_insert(out, target, start, end):
+    while start < end:
+        size = min(MAX_INSERT, end - start)
+        out.append(size)
+        out += target[start:start + size]
+        start += size
+
+def _encode_varint(value):
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+def _decode_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
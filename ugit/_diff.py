@@ -1,8 +1,19 @@
-import difflib
-import merge3
-from collections import defaultdict
+import os
+from collections import defaultdict, namedtuple
 
 from . import data
+from . import _linediff
+from . import _rename
+
+MERGE_WORKERS = int(os.environ.get('UGIT_MERGE_WORKERS', os.cpu_count() or 1))
+# Below this many divergent files, starting worker processes costs more than it saves
+PARALLEL_MERGE_MIN = 8
+BINARY_CHECK_SIZE = 8000
+# 'histogram' or 'myers', see _linediff
+DIFF_ALGORITHM = os.environ.get('UGIT_DIFF_ALGORITHM', 'histogram')
+
+# kind is one of 'content', 'modify/delete', 'add/add' or 'file/directory'
+Conflict = namedtuple('Conflict', ['path', 'kind', 'base', 'HEAD', 'other'])
 
 
 def compare_trees(*trees):
@@ -14,42 +25,89 @@ def compare_trees(*trees):
     for path, oids in entries.items():
         yield (path, *oids)
     
-def iter_changed_files(t_from, t_to):
-    for path, o_from, o_to in compare_trees(t_from, t_to):
-        if o_from != o_to:
-            action = (
-                'new file' if not o_from else
-                'delted' if not o_to else
-                'modified'
-            )
-            yield path, action
-
-def diff_trees(t_from, t_to):
-    output = ''
+def iter_changes(t_from, t_to):
     for path, o_from, o_to in compare_trees(t_from, t_to):
         if o_from != o_to:
-            # output += f"changed: {path}\n"
-            output += diff_blobs(o_from, o_to, path)
-    
-    return output
-
-def merge_trees(t_base, t_HEAD, t_other):
-    tree = {}
-    for path, o_base, o_HEAD, o_other in compare_trees(t_base, t_HEAD, t_other):
-        tree[path] = data.hash_object(merge_blobs(o_base, o_HEAD, o_other))
-    return tree
-
-def merge_blobs(o_base, o_HEAD, o_other):
-    content_base = data.get_object(o_base) if o_base else b''
-    content_HEAD = data.get_object(o_HEAD) if o_HEAD else b''
-    content_other = data.get_object(o_other) if o_other else b''
-
-    base_lines = content_base.decode(errors='replace').splitlines(keepends=True)
-    HEAD_lines = content_HEAD.decode(errors='replace').splitlines(keepends=True)
-    other_lines = content_other.decode(errors='replace').splitlines(keepends=True)
+            yield path, o_from, o_to
+
+def iter_changed_files(t_from, t_to, to_working=False):
+    return describe_changes(find_renames(iter_changes(t_from, t_to), to_working))
+
+def find_renames(changes, to_working=False, copies=False, old_tree=None):
+    # Replaces deleted and added files that are the same file moved with
+    # _rename.Rename entries; old_tree gives unchanged files to copy from
+    def read_to(path, oid):
+        return _read_working_file(path) if to_working else data.get_object(oid)
+    changes = list(changes)
+    deleted = [o_from for _, o_from, o_to in changes if not o_to]
+    added = [o_to for _, o_from, o_to in changes if not o_from]
+    if deleted and added:
+        data.prefetch_objects(deleted + ([] if to_working else added))
+    return _rename.find_renames(changes, lambda path, oid: data.get_object(oid), read_to, copies=copies, old_tree=old_tree)
+
+def describe_changes(changes):
+    for change in changes:
+        if isinstance(change, _rename.Rename):
+            yield f"{change.old_path} -> {change.path}", 'copied' if change.copy else 'renamed'
+            continue
+        path, o_from, o_to = change
+        action = (
+            'new file' if not o_from else
+            'delted' if not o_to else
+            'modified'
+        )
+        yield path, action
+
+def diff_changes(changes, to_working=False):
+    # Yields the patch line by line, so callers can write it out as it is
+    # produced instead of holding all of it
+    changes = list(changes)
+    data.prefetch_objects(_blob_oids(changes, to_working))
+    for change in changes:
+        if isinstance(change, _rename.Rename):
+            kind = 'copy' if change.copy else 'rename'
+            yield f"similarity index {change.similarity}%\n"
+            yield f"{kind} from {change.old_path}\n"
+            yield f"{kind} to {change.path}\n"
+            if change.o_from != change.o_to:
+                yield from diff_blobs(change.o_from, change.o_to, change.path, to_working, change.old_path)
+            continue
+        path, o_from, o_to = change
+        # output += f"changed: {path}\n"
+        yield from diff_blobs(o_from, o_to, path, to_working)
+
+def _blob_oids(changes, to_working):
+    for change in changes:
+        o_from, o_to = (change.o_from, change.o_to) if isinstance(change, _rename.Rename) else change[1:]
+        yield o_from
+        if not to_working:
+            yield o_to
+
+def merge_blobs_parallel(blobs, workers=None):
+    # blobs: list of (o_base, o_HEAD, o_other). Returns (merged content,
+    # conflicted) for each, merging in worker processes when there are many
+    workers = workers or MERGE_WORKERS
+    data.prefetch_objects(oid for oids in blobs for oid in oids)
+    contents = [_read_merge_contents(*oids) for oids in blobs]
+    if workers > 1 and len(contents) >= PARALLEL_MERGE_MIN:
+        # multiprocessing is slow to import and only merges need it
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(workers) as executor:
+            return list(executor.map(_merge_contents, contents, chunksize=4))
+    return [_merge_contents(content) for content in contents]
+
+def _read_merge_contents(o_base, o_HEAD, o_other):
+    return tuple(data.get_object(oid) if oid else b'' for oid in (o_base, o_HEAD, o_other))
+
+def _merge_contents(contents):
+    import merge3
+    base_lines, HEAD_lines, other_lines = (
+        content.decode(errors='replace').splitlines(keepends=True) for content in contents
+    )
     merger = merge3.Merge3(base_lines, other_lines, HEAD_lines)
     merged_lines = merger.merge_lines()
-    return ''.join(merged_lines)
+    conflicted = any(region[0] == 'conflict' for region in merger.merge_regions())
+    return ''.join(merged_lines).encode(), conflicted
 
 # def merge_blobs(o_HEAD, o_other):
 #     content_HEAD = data.get_object(o_HEAD) if o_HEAD else b''
@@ -69,9 +127,26 @@ def merge_blobs(o_base, o_HEAD, o_other):
 #             merged.append(f">>>>>> others{o_other}\n{content_other[b_start:b_end]}")
 #     return '\n'.join(merged)
 
-def diff_blobs(o_from, o_to, path='blob'):
+def diff_blobs(o_from, o_to, path='blob', to_working=False, old_path=None):
+    old_path = old_path or path
     content_from = data.get_object(o_from) if o_from else b''
-    content_to = data.get_object(o_to) if o_to else b''
-    diff = difflib.unified_diff(content_from.decode(errors='replace').splitlines(), content_to.decode(errors='replace').splitlines(), f'a/{path}', f'b/{path}')
-    return '\n'.join(diff)
+    if to_working:
+        # Working tree blobs are hashed without being written to the object store
+        content_to = _read_working_file(path) if o_to else b''
+    else:
+        content_to = data.get_object(o_to) if o_to else b''
+    if is_binary(content_from) or is_binary(content_to):
+        yield f"Binary files a/{old_path} and b/{path} differ\n"
+        return
+    diff = _linediff.unified_diff(content_from.decode(errors='replace').splitlines(), content_to.decode(errors='replace').splitlines(), f'a/{old_path}', f'b/{path}', algorithm=DIFF_ALGORITHM)
+    for line in diff:
+        yield line + '\n'
+
+def is_binary(content):
+    # Same heuristic as git: a NUL byte near the start
+    return b'\0' in content[:BINARY_CHECK_SIZE]
+
+def _read_working_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
     
@@ -0,0 +1,210 @@
+import os
+import errno
+import select
+import struct
+
+from collections import namedtuple
+
+# A daemon watching the working tree with inotify. Clients ask what changed
+# since a token they got earlier; paths come back relative to the top of
+# the working tree. A client with no token, a token from another daemon or
+# one from before an event queue overflow is told to scan everything.
+# Every status imports this module, so what only the daemon or a query to it
+# needs (ctypes, sockets, the transport) is imported when first used.
+
+SOCKET_NAME = 'fsmonitor.sock'
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+)
+EVENT = struct.Struct('iIII')
+# Past this many changed paths the daemon forgets them and reports an overflow
+MAX_CHANGES = 1000000
+
+# paths: files to look at again. dirs: directories that appeared or went
+# away, to be rescanned as a whole. Both are None when everything must be
+# scanned.
+Changes = namedtuple('Changes', ['token', 'paths', 'dirs'])
+
+
+def socket_path(git_dir):
+    return os.path.join(git_dir, SOCKET_NAME)
+
+def query(git_dir, token):
+    # Changes since token, or None when no daemon is running
+    path = socket_path(git_dir)
+    if not os.path.exists(path):
+        return None
+    from . import _transport
+    try:
+        with _transport.connect(f"{_transport.SOCKET_PREFIX}{path}") as connection:
+            response = connection.request({'command': 'query', 'token': token})
+    except (OSError, AssertionError):
+        return None
+    if response['full']:
+        return Changes(response['token'], None, None)
+    return Changes(response['token'], response['paths'], response['dirs'])
+
+def stop(git_dir):
+    from . import _transport
+    with _transport.connect(f"{_transport.SOCKET_PREFIX}{socket_path(git_dir)}") as connection:
+        connection.request({'command': 'stop'})
+
+
+class Monitor:
+
+    def __init__(self, top, skip):
+        # skip: names of directories never watched, like the repository's own
+        import ctypes
+        import ctypes.util
+        self._ctypes = ctypes
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._top = top
+        self._skip = skip
+        self._instance = os.urandom(8).hex()
+        self._watches = {}
+        self._seq = 0
+        self._overflow_seq = 0
+        self._paths = {}
+        self._dirs = {}
+        # False once a directory could not be watched
+        self._complete = True
+        self._watch_tree('')
+
+    def token(self):
+        return f"{self._instance}:{self._seq}"
+
+    def changes_since(self, token):
+        self.drain()
+        instance, _, seq = (token or '').partition(':')
+        if not self._complete or instance != self._instance or int(seq) < self._overflow_seq:
+            return Changes(self.token(), None, None)
+        seq = int(seq)
+        return Changes(
+            self.token(),
+            sorted(path for path, changed in self._paths.items() if changed > seq),
+            sorted(path for path, changed in self._dirs.items() if changed > seq),
+        )
+
+    def drain(self):
+        # Every event for a change made before this call is already queued
+        while True:
+            try:
+                buffer = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            self._seq += 1
+            pos = 0
+            while pos < len(buffer):
+                wd, mask, _, length = EVENT.unpack_from(buffer, pos)
+                name = buffer[pos + EVENT.size:pos + EVENT.size + length].rstrip(b'\0')
+                pos += EVENT.size + length
+                self._handle(wd, mask, os.fsdecode(name))
+
+    def _handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            self._overflow()
+            return
+        directory = self._watches.get(wd)
+        if directory is None:
+            return
+        if mask & IN_IGNORED:
+            del self._watches[wd]
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF) or not name:
+            return
+        path = f"{directory}/{name}" if directory else name
+        if mask & IN_ISDIR:
+            if name in self._skip and not directory:
+                return
+            self._dirs[path] = self._seq
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch_tree(path)
+        else:
+            self._paths[path] = self._seq
+        if len(self._paths) + len(self._dirs) > MAX_CHANGES:
+            self._overflow()
+
+    def _overflow(self):
+        self._overflow_seq = self._seq
+        self._paths.clear()
+        self._dirs.clear()
+
+    def _watch_tree(self, top):
+        for root, dirnames, _ in os.walk(os.path.join(self._top, top) if top else self._top):
+            if root == self._top:
+                dirnames[:] = [dirname for dirname in dirnames if dirname not in self._skip]
+            relative = os.path.relpath(root, self._top).replace(os.sep, '/')
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(root), WATCH_MASK)
+            if wd < 0:
+                if self._ctypes.get_errno() == errno.ENOSPC:
+                    # Out of watches: nothing the daemon says can be trusted
+                    self._complete = False
+                    return
+                continue
+            self._watches[wd] = '' if relative == '.' else relative
+
+    def close(self):
+        os.close(self.fd)
+
+
+def serve(top, git_dir):
+    import socket
+    from . import _transport
+    monitor = Monitor(top, skip={os.path.basename(git_dir)})
+    path = socket_path(git_dir)
+    if os.path.exists(path):
+        os.remove(path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(path)
+        server.listen()
+        try:
+            while True:
+                readable, _, _ = select.select([server, monitor.fd], [], [])
+                if monitor.fd in readable:
+                    monitor.drain()
+                if server not in readable:
+                    continue
+                sock, _ = server.accept()
+                with sock, sock.makefile('rb') as reader, sock.makefile('wb') as writer:
+                    if not _handle_client(monitor, _transport.Connection(reader, writer)):
+                        return
+        finally:
+            monitor.close()
+            if os.path.exists(path):
+                os.remove(path)
+
+def _handle_client(monitor, connection):
+    message = connection.recv()
+    if message is None:
+        return True
+    if message['command'] == 'stop':
+        connection.send({'ok': True})
+        return False
+    changes = monitor.changes_since(message.get('token'))
+    connection.send({
+        'token': changes.token,
+        'full': changes.paths is None,
+        'paths': changes.paths,
+        'dirs': changes.dirs,
+    })
+    return True
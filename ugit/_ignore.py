@@ -0,0 +1,104 @@
+import os
+import re
+
+from collections import namedtuple
+
+# The repository directory is never tracked, whatever .ugitignore says
+ALWAYS_IGNORED = ['.ugit/']
+
+Pattern = namedtuple('Pattern', ['regex', 'negated', 'dir_only'])
+
+
+class IgnoreMatcher:
+
+    def __init__(self, lines):
+        self.patterns = [pattern for pattern in map(compile_pattern, ALWAYS_IGNORED + list(lines)) if pattern]
+        # Without negations the order doesn't matter and one regex per kind
+        # of path answers the query
+        self._combined = None
+        if not any(pattern.negated for pattern in self.patterns):
+            self._combined = (
+                _combine(pattern for pattern in self.patterns if not pattern.dir_only),
+                _combine(self.patterns),
+            )
+
+    def match(self, path, is_dir=False):
+        # Whether path itself matches; the last matching pattern wins
+        path = path.replace(os.sep, '/')
+        if self._combined is not None:
+            return bool(self._combined[is_dir].match(path))
+        for pattern in reversed(self.patterns):
+            if pattern.dir_only and not is_dir:
+                continue
+            if pattern.regex.match(path):
+                return not pattern.negated
+        return False
+
+    def is_ignored(self, path, is_dir=False):
+        # Like git, nothing inside an ignored directory can be re-included
+        parts = path.replace(os.sep, '/').split('/')
+        for i in range(1, len(parts)):
+            if self.match('/'.join(parts[:i]), is_dir=True):
+                return True
+        return self.match(path, is_dir)
+
+
+def _combine(patterns):
+    return re.compile('|'.join(f"(?:{pattern.regex.pattern})" for pattern in patterns) or '(?!)')
+
+def compile_pattern(line):
+    line = line.rstrip('\n')
+    if not line.strip() or line.startswith('#'):
+        return None
+    line = line.rstrip(' ')
+    negated = line.startswith('!')
+    if negated:
+        line = line[1:]
+    elif line.startswith('\\'):
+        line = line[1:]
+    dir_only = line.endswith('/')
+    line = line.rstrip('/')
+    # A slash anywhere but at the end anchors the pattern to the top level,
+    # otherwise it matches the name at any depth
+    anchored = '/' in line
+    line = line.lstrip('/')
+    prefix = '' if anchored else '(?:.*/)?'
+    return Pattern(re.compile(prefix + _translate(line) + '$'), negated, dir_only)
+
+def _translate(glob):
+    out = []
+    i = 0
+    while i < len(glob):
+        c = glob[i]
+        if glob.startswith('**', i) and (i == 0 or glob[i - 1] == '/'):
+            end = i + 2
+            if end == len(glob):
+                out.append('.*')
+                i = end
+                continue
+            if glob[end] == '/':
+                out.append('(?:.*/)?')
+                i = end + 1
+                continue
+        if c == '*':
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            end = glob.find(']', i + 2)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                body = glob[i + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append(f"[{body.replace(chr(92), chr(92) * 2)}]")
+                i = end + 1
+                continue
+        elif c == '\\' and i + 1 < len(glob):
+            i += 1
+            out.append(re.escape(glob[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
@@ -0,0 +1,178 @@
+import os
+import mmap
+import struct
+import hashlib
+import orjson
+
+from collections import namedtuple
+from collections.abc import MutableMapping
+
+SIGNATURE = b'UIND'
+VERSION = 1
+
+HEADER = struct.Struct('>4sII')
+# oid, mtime_ns, size, ino, mode, offset and length of the path
+RECORD = struct.Struct('>20sqQQIII')
+CHECKSUM_SIZE = 20
+
+# Records are sorted by path and followed by all paths back to back, then a
+# SHA-1 of everything before it. Lookups binary search the mapped file; the
+# entries are only copied into a dict once something changes.
+
+IndexEntry = namedtuple('IndexEntry', ['oid', 'mtime_ns', 'size', 'ino', 'mode'])
+
+
+class Index(MutableMapping):
+
+    def __init__(self, path):
+        self.path = path
+        self.dirty = False
+        self._map = None
+        self._entries = None
+        self.count = 0
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            self._entries = {}
+            return
+        with f:
+            if not os.fstat(f.fileno()).st_size:
+                self._entries = {}
+                return
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(SIGNATURE)] != SIGNATURE:
+            # A JSON index from before this format; it is rewritten on the
+            # first change
+            self._entries = _load_json(self._map[:])
+            self.close()
+            self.dirty = True
+            return
+        signature, version, self.count = HEADER.unpack_from(self._map)
+        assert version == VERSION, f"Unsupported index version {version}"
+        checksum = hashlib.sha1(memoryview(self._map)[:-CHECKSUM_SIZE]).digest()
+        assert checksum == self._map[-CHECKSUM_SIZE:], f"Corrupt index {path}"
+
+    def __getitem__(self, path):
+        if self._entries is not None:
+            return self._entries[path]
+        position = self._find(os.fsencode(path))
+        if position is None:
+            raise KeyError(path)
+        return self._entry(position)
+
+    def __contains__(self, path):
+        if self._entries is not None:
+            return path in self._entries
+        return self._find(os.fsencode(path)) is not None
+
+    def __iter__(self):
+        if self._entries is not None:
+            return iter(self._entries)
+        return (os.fsdecode(self._path(i)) for i in range(self.count))
+
+    def __len__(self):
+        return len(self._entries) if self._entries is not None else self.count
+
+    def items(self):
+        if self._entries is not None:
+            return self._entries.items()
+        return list(self._iter_mapped())
+
+    def __setitem__(self, path, entry):
+        if self.get(path) == entry:
+            return
+        self._materialize()[path] = entry
+        self.dirty = True
+
+    def __delitem__(self, path):
+        del self._materialize()[path]
+        self.dirty = True
+
+    def clear(self):
+        if len(self):
+            self._entries = {}
+            self.close()
+            self.dirty = True
+
+    def write(self):
+        entries = self._materialize()
+        self.close()
+        write(self.path, entries)
+        self.dirty = False
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _materialize(self):
+        if self._entries is None:
+            self._entries = dict(self._iter_mapped())
+            self.close()
+        return self._entries
+
+    def _iter_mapped(self):
+        records = memoryview(self._map)[HEADER.size:HEADER.size + self.count * RECORD.size]
+        for oid, mtime_ns, size, ino, mode, offset, length in RECORD.iter_unpack(records):
+            path = os.fsdecode(self._map[offset:offset + length])
+            yield path, IndexEntry(oid.hex(), mtime_ns, size, ino, mode)
+
+    def _record(self, position):
+        return RECORD.unpack_from(self._map, HEADER.size + position * RECORD.size)
+
+    def _path(self, position):
+        *_, offset, length = self._record(position)
+        return self._map[offset:offset + length]
+
+    def _entry(self, position):
+        oid, mtime_ns, size, ino, mode, _, _ = self._record(position)
+        return IndexEntry(oid.hex(), mtime_ns, size, ino, mode)
+
+    def _find(self, key):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            current = self._path(mid)
+            if current < key:
+                lo = mid + 1
+            elif current > key:
+                hi = mid
+            else:
+                return mid
+        return None
+
+
+def write(path, entries):
+    paths = sorted((os.fsencode(name), entry) for name, entry in entries.items())
+    offset = HEADER.size + len(paths) * RECORD.size
+    chunks = [HEADER.pack(SIGNATURE, VERSION, len(paths))]
+    for name, entry in paths:
+        chunks.append(RECORD.pack(
+            bytes.fromhex(entry.oid), entry.mtime_ns, entry.size, entry.ino, entry.mode, offset, len(name),
+        ))
+        offset += len(name)
+    chunks.extend(name for name, _ in paths)
+    content = b''.join(chunks)
+
+    # Other writers are kept out by the lock file, readers see either the
+    # old or the new index
+    lock_path = f"{path}.lock"
+    try:
+        fd = os.open(lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    except FileExistsError:
+        assert False, f"{lock_path} exists, another ugit process is writing the index"
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+            f.write(hashlib.sha1(content).digest())
+        os.replace(lock_path, path)
+    except BaseException:
+        os.remove(lock_path)
+        raise
+
+def _load_json(content):
+    entries = {}
+    for path, entry in orjson.loads(content).items():
+        # Older still, a bare oid per path
+        entries[path] = IndexEntry(*entry) if isinstance(entry, list) else IndexEntry(entry, 0, 0, 0, 0)
+    return entries
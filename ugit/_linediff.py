@@ -0,0 +1,279 @@
+import math
+
+# Line diffs for unified output. Lines are interned to small ints first, so
+# the algorithms only ever compare ints, and each algorithm returns matching
+# blocks (i, j, n) meaning a[i:i + n] == b[j:j + n], like difflib does.
+
+# Myers gives up on finding the shortest edit script past this many edits,
+# scaled with the input like xdiff does, and settles for a good split instead
+MIN_COST = 256
+# Lines occurring more often than this are never used as histogram anchors
+MAX_CHAIN = 64
+CONTEXT = 3
+
+
+def intern_lines(a, b):
+    ids = {}
+    return [ids.setdefault(line, len(ids)) for line in a], [ids.setdefault(line, len(ids)) for line in b]
+
+
+def myers(a, b):
+    blocks = []
+    _myers_region(a, b, 0, len(a), 0, len(b), _max_cost(a, b), blocks)
+    return _finish(blocks, len(a), len(b))
+
+def histogram(a, b):
+    # Anchor each region on its rarest line that both sides share, then diff
+    # what is left on either side of the anchor; this keeps frequent lines
+    # like blank lines and braces from pairing up unrelated changes
+    blocks = []
+    max_cost = _max_cost(a, b)
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        region = _trim(a, b, *stack.pop(), blocks)
+        if region is None:
+            continue
+        alo, ahi, blo, bhi = region
+        anchor = _find_anchor(a, b, alo, ahi, blo, bhi)
+        if anchor is None:
+            _myers_region(a, b, alo, ahi, blo, bhi, max_cost, blocks)
+            continue
+        i, j, n = anchor
+        blocks.append(anchor)
+        stack.append((i + n, ahi, j + n, bhi))
+        stack.append((alo, i, blo, j))
+    return _finish(blocks, len(a), len(b))
+
+ALGORITHMS = {
+    'myers': myers,
+    'histogram': histogram,
+}
+
+
+def matching_blocks(a, b, algorithm='histogram'):
+    a_ids, b_ids = intern_lines(a, b)
+    return ALGORITHMS[algorithm](a_ids, b_ids)
+
+def unified_diff(a, b, fromfile='', tofile='', n=CONTEXT, algorithm='histogram'):
+    # Same output as difflib.unified_diff(..., lineterm='')
+    started = False
+    for group in _grouped_opcodes(matching_blocks(a, b, algorithm), n):
+        if not started:
+            started = True
+            yield f"--- {fromfile}"
+            yield f"+++ {tofile}"
+        first, last = group[0], group[-1]
+        yield f"@@ -{_format_range(first[1], last[2])} +{_format_range(first[3], last[4])} @@"
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                for line in a[i1:i2]:
+                    yield ' ' + line
+                continue
+            if tag in ('replace', 'delete'):
+                for line in a[i1:i2]:
+                    yield '-' + line
+            if tag in ('replace', 'insert'):
+                for line in b[j1:j2]:
+                    yield '+' + line
+
+
+def _max_cost(a, b):
+    return max(MIN_COST, math.isqrt(len(a) + len(b)))
+
+def _trim(a, b, alo, ahi, blo, bhi, blocks):
+    # Records the common prefix and suffix of a region as matches, returns
+    # what is left or None when nothing is
+    start = alo
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        alo += 1
+        blo += 1
+    if alo > start:
+        blocks.append((start, blo - (alo - start), alo - start))
+    end = ahi
+    while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+        ahi -= 1
+        bhi -= 1
+    if ahi < end:
+        blocks.append((ahi, bhi, end - ahi))
+    if alo == ahi or blo == bhi:
+        return None
+    return alo, ahi, blo, bhi
+
+def _myers_region(a, b, alo, ahi, blo, bhi, max_cost, blocks):
+    stack = [(alo, ahi, blo, bhi)]
+    while stack:
+        region = _trim(a, b, *stack.pop(), blocks)
+        if region is None:
+            continue
+        alo, ahi, blo, bhi = region
+        x, y = _bisect(a, b, alo, ahi, blo, bhi, max_cost)
+        if x is None:
+            continue
+        stack.append((alo + x, ahi, blo + y, bhi))
+        stack.append((alo, alo + x, blo, blo + y))
+
+def _bisect(a, b, alo, ahi, blo, bhi, max_cost):
+    # Finds the middle snake of the region by searching forwards from its
+    # start and backwards from its end at once (Myers' linear space variant).
+    # Returns the split point relative to (alo, blo), or (None, None) when
+    # the two sides have nothing in common.
+    n = ahi - alo
+    m = bhi - blo
+    max_d = (n + m + 1) // 2
+    offset = max_d
+    forward = [-1] * (2 * max_d + 2)
+    backward = [-1] * (2 * max_d + 2)
+    forward[offset + 1] = 0
+    backward[offset + 1] = 0
+    delta = n - m
+    odd = delta % 2 != 0
+    # Diagonals that ran off the edge of the region are not searched again
+    f_start = f_end = b_start = b_end = 0
+
+    for d in range(max_d):
+        if d > max_cost:
+            return _best_split(forward, offset, d, f_start, f_end, n, m)
+
+        for k in range(-d + f_start, d + 1 - f_end, 2):
+            k_offset = offset + k
+            if k == -d or (k != d and forward[k_offset - 1] < forward[k_offset + 1]):
+                x = forward[k_offset + 1]
+            else:
+                x = forward[k_offset - 1] + 1
+            y = x - k
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            forward[k_offset] = x
+            if x > n:
+                f_end += 2
+            elif y > m:
+                f_start += 2
+            elif odd:
+                other = offset + delta - k
+                if 0 <= other < len(backward) and backward[other] != -1 and x >= n - backward[other]:
+                    return x, y
+
+        for k in range(-d + b_start, d + 1 - b_end, 2):
+            k_offset = offset + k
+            if k == -d or (k != d and backward[k_offset - 1] < backward[k_offset + 1]):
+                x = backward[k_offset + 1]
+            else:
+                x = backward[k_offset - 1] + 1
+            y = x - k
+            while x < n and y < m and a[ahi - 1 - x] == b[bhi - 1 - y]:
+                x += 1
+                y += 1
+            backward[k_offset] = x
+            if x > n:
+                b_end += 2
+            elif y > m:
+                b_start += 2
+            elif not odd:
+                other = offset + delta - k
+                if 0 <= other < len(forward) and forward[other] != -1:
+                    fx = forward[other]
+                    if fx >= n - x:
+                        return fx, fx - (other - offset)
+
+    return None, None
+
+def _best_split(forward, offset, d, f_start, f_end, n, m):
+    # Too expensive to finish: split at the forward path that got furthest
+    best = None
+    for k in range(-d + 1 + f_start, d - f_end, 2):
+        x = forward[offset + k]
+        y = x - k
+        if 0 <= x <= n and 0 <= y <= m and (best is None or x + y > best[0] + best[1]):
+            best = x, y
+    if best is None or best in ((0, 0), (n, m)):
+        return None, None
+    return best
+
+def _find_anchor(a, b, alo, ahi, blo, bhi):
+    positions = {}
+    for i in range(alo, ahi):
+        positions.setdefault(a[i], []).append(i)
+
+    best = None
+    best_count = MAX_CHAIN
+    j = blo
+    while j < bhi:
+        occurrences = positions.get(b[j])
+        next_j = j + 1
+        if occurrences and len(occurrences) <= min(best_count, MAX_CHAIN):
+            for i in occurrences:
+                start_i, start_j = i, j
+                while start_i > alo and start_j > blo and a[start_i - 1] == b[start_j - 1]:
+                    start_i -= 1
+                    start_j -= 1
+                end_i, end_j = i + 1, j + 1
+                while end_i < ahi and end_j < bhi and a[end_i] == b[end_j]:
+                    end_i += 1
+                    end_j += 1
+                length = end_i - start_i
+                # Rarer anchors win, then longer ones
+                if best is None or len(occurrences) < best_count or length > best[2]:
+                    best = start_i, start_j, length
+                    best_count = len(occurrences)
+                next_j = max(next_j, end_j)
+        j = next_j
+    return best
+
+def _finish(blocks, len_a, len_b):
+    blocks.sort()
+    merged = []
+    for i, j, n in blocks:
+        if merged and merged[-1][0] + merged[-1][2] == i and merged[-1][1] + merged[-1][2] == j:
+            last = merged.pop()
+            merged.append((last[0], last[1], last[2] + n))
+        else:
+            merged.append((i, j, n))
+    merged.append((len_a, len_b, 0))
+    return merged
+
+def _opcodes(blocks):
+    i = j = 0
+    for ai, bj, size in blocks:
+        if i < ai and j < bj:
+            yield 'replace', i, ai, j, bj
+        elif i < ai:
+            yield 'delete', i, ai, j, bj
+        elif j < bj:
+            yield 'insert', i, ai, j, bj
+        i, j = ai + size, bj + size
+        if size:
+            yield 'equal', ai, i, bj, j
+
+def _grouped_opcodes(blocks, n):
+    # Hunks with n lines of context, merged when their context overlaps;
+    # the same grouping as difflib.SequenceMatcher.get_grouped_opcodes
+    codes = list(_opcodes(blocks))
+    if not codes:
+        codes = [('equal', 0, 1, 0, 1)]
+    if codes[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+    if codes[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == 'equal' and i2 - i1 > 2 * n:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        yield group
+
+def _format_range(start, stop):
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return f"{beginning}"
+    if not length:
+        beginning -= 1
+    return f"{beginning},{length}"
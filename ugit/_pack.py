@@ -0,0 +1,274 @@
+import os
+import mmap
+import struct
+import hashlib
+import threading
+
+from collections import OrderedDict
+
+from . import _codec
+from . import _delta
+
+PACK_SIGNATURE = b'UPCK'
+INDEX_SIGNATURE = b'UIDX'
+VERSION = 1
+
+OBJ_RAW = 0
+OBJ_FULL = 1
+OBJ_REF_DELTA = 2
+
+DELTA_WINDOW = 10
+MAX_DELTA_DEPTH = 10
+MIN_DELTA_SIZE = 64
+BASE_CACHE_SIZE = 16 * 1024 * 1024
+
+HEADER = struct.Struct('>4sII')
+FANOUT = struct.Struct('>256I')
+ENTRY = struct.Struct('>20sQQ')
+# Streamed packs have no index, so every record carries its oid and size
+STREAM_ENTRY = struct.Struct('>20sQ')
+OID_SIZE = 20
+
+
+def write_pack(pack_dir, oids, read_object, codec='zlib', window=DELTA_WINDOW, max_depth=MAX_DELTA_DEPTH):
+    return _store_pack(pack_dir, _iter_records(oids, read_object, codec, window, max_depth))
+
+def write_pack_stream(out, oids, read_object, codec='zlib', window=DELTA_WINDOW, max_depth=MAX_DELTA_DEPTH):
+    oids = list(oids)
+    out.write(HEADER.pack(PACK_SIGNATURE, VERSION, len(oids)))
+    for oid, record in _iter_records(oids, read_object, codec, window, max_depth):
+        out.write(STREAM_ENTRY.pack(bytes.fromhex(oid), len(record)))
+        out.write(record)
+    out.flush()
+
+def store_pack_stream(pack_dir, stream, unpack_limit=0, write_object=None):
+    # Deltas in a stream only refer to objects of the same stream, so it can
+    # be stored as a pack of its own as it is read. A stream of fewer than
+    # unpack_limit objects is unpacked into write_object(oid, obj) instead;
+    # its bases always come before the deltas on them.
+    signature, version, count = HEADER.unpack(_read_exact(stream, HEADER.size))
+    assert signature == PACK_SIGNATURE, "Bad pack stream"
+    assert version == VERSION, f"Unsupported pack stream version {version}"
+    if not count:
+        return None
+
+    def iter_records():
+        for _ in range(count):
+            oid, size = STREAM_ENTRY.unpack(_read_exact(stream, STREAM_ENTRY.size))
+            yield oid.hex(), _read_exact(stream, size)
+
+    if count < unpack_limit:
+        objects = {}
+        for oid, record in iter_records():
+            objects[oid] = _decode_record(record[0], record[1:], objects.__getitem__)
+            write_object(oid, objects[oid])
+        return None
+    return _store_pack(pack_dir, iter_records())
+
+def _read_exact(stream, size):
+    data = stream.read(size)
+    assert len(data) == size, "Truncated pack stream"
+    return data
+
+def _store_pack(pack_dir, records):
+    os.makedirs(pack_dir, exist_ok=True)
+    entries = []
+    tmp_pack = f"{pack_dir}/tmp_pack_{os.getpid()}"
+    with open(tmp_pack, 'wb') as f:
+        f.write(HEADER.pack(PACK_SIGNATURE, VERSION, 0))
+        offset = HEADER.size
+        for oid, record in records:
+            f.write(record)
+            entries.append((bytes.fromhex(oid), offset, len(record)))
+            offset += len(record)
+        f.seek(0)
+        f.write(HEADER.pack(PACK_SIGNATURE, VERSION, len(entries)))
+
+    entries.sort()
+    name = hashlib.sha1(b''.join(oid for oid, _, _ in entries)).hexdigest()
+    pack_path = f"{pack_dir}/pack-{name}.pack"
+    os.replace(tmp_pack, pack_path)
+    # The index is written last: a pack is only visible once its index exists
+    tmp_index = f"{pack_dir}/tmp_idx_{os.getpid()}"
+    with open(tmp_index, 'wb') as f:
+        f.write(HEADER.pack(INDEX_SIGNATURE, VERSION, len(entries)))
+        f.write(FANOUT.pack(*_fanout(entries)))
+        for entry in entries:
+            f.write(ENTRY.pack(*entry))
+    os.replace(tmp_index, f"{pack_dir}/pack-{name}.idx")
+    return pack_path
+
+def _iter_records(oids, read_object, codec, window, max_depth):
+    # Like git, try objects of the same type and similar size as delta bases:
+    # sorting by size (largest first) puts versions of one file next to each
+    # other, and deltas then mostly remove data
+    order = []
+    for oid in oids:
+        obj = read_object(oid)
+        order.append((obj.partition(b'\x00')[0], len(obj), oid))
+    order.sort(key=lambda item: (item[0], -item[1]))
+
+    candidates = []
+    depths = {}
+    for type_, size, oid in order:
+        obj = read_object(oid)
+        best = None
+        if size >= MIN_DELTA_SIZE:
+            for base_type, base_oid, base_index in candidates:
+                if base_type != type_ or depths[base_oid] >= max_depth:
+                    continue
+                if len(base_index.base) > size * 32:
+                    continue
+                max_size = (size // 2) if best is None else len(best[1]) - 1
+                delta = base_index.delta(obj, max_size)
+                if delta is not None:
+                    best = (base_oid, delta)
+
+        if best is None:
+            depths[oid] = 0
+            yield oid, bytes([OBJ_FULL]) + _codec.compress(obj, codec)
+        else:
+            base_oid, delta = best
+            depths[oid] = depths[base_oid] + 1
+            yield oid, bytes([OBJ_REF_DELTA]) + bytes.fromhex(base_oid) + _codec.compress(delta, codec)
+
+        if size >= MIN_DELTA_SIZE:
+            candidates.append((type_, oid, _delta.DeltaIndex(obj)))
+            if len(candidates) > window:
+                candidates.pop(0)
+
+def _fanout(entries):
+    fanout = [0] * 256
+    for oid, _, _ in entries:
+        fanout[oid[0]] += 1
+    total = 0
+    for i, count in enumerate(fanout):
+        total += count
+        fanout[i] = total
+    return fanout
+
+
+class Pack:
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.pack_path = index_path[:-len('.idx')] + '.pack'
+        self.bitmap_path = index_path[:-len('.idx')] + '.bitmap'
+        self._index = _map(index_path)
+        self._pack = _map(self.pack_path)
+        signature, version, self.count = HEADER.unpack_from(self._index)
+        assert signature == INDEX_SIGNATURE, f"Bad pack index {index_path}"
+        assert version == VERSION, f"Unsupported pack index version {version}"
+        self._fanout = FANOUT.unpack_from(self._index, HEADER.size)
+        self._entries_start = HEADER.size + FANOUT.size
+        self._base_cache = OrderedDict()
+        self._base_cache_size = 0
+        self._base_cache_lock = threading.Lock()
+
+    def position(self, oid):
+        # Position of oid in the sorted index: a stable numbering of the
+        # pack's objects, used as bit positions by reachability bitmaps
+        key = bytes.fromhex(oid)
+        lo = self._fanout[key[0] - 1] if key[0] else 0
+        hi = self._fanout[key[0]]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = self._entries_start + mid * ENTRY.size
+            current = self._index[pos:pos + OID_SIZE]
+            if current < key:
+                lo = mid + 1
+            elif current > key:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def iter_prefix(self, prefix):
+        # Oids starting with the hex prefix, which is at least two digits long:
+        # a binary search for the first candidate, then a scan while they match
+        key = bytes.fromhex((prefix + '0' * OID_SIZE * 2)[:OID_SIZE * 2])
+        lo = self._fanout[key[0] - 1] if key[0] else 0
+        hi = self._fanout[key[0]]
+        end = hi
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = self._entries_start + mid * ENTRY.size
+            if self._index[pos:pos + OID_SIZE] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        for position in range(lo, end):
+            oid = self.oid_at(position)
+            if not oid.startswith(prefix):
+                return
+            yield oid
+
+    def oid_at(self, position):
+        pos = self._entries_start + position * ENTRY.size
+        return self._index[pos:pos + OID_SIZE].hex()
+
+    def _find(self, oid):
+        position = self.position(oid)
+        if position is None:
+            return None
+        return ENTRY.unpack_from(self._index, self._entries_start + position * ENTRY.size)[1:]
+
+    def __contains__(self, oid):
+        return self.position(oid) is not None
+
+    def read(self, oid):
+        found = self._find(oid)
+        if found is None:
+            return None
+        offset, length = found
+        return _decode_record(self._pack[offset], self._pack[offset + 1:offset + length], self._read_base)
+
+    def _read_base(self, oid):
+        # Bases are shared by every delta in their chain, keep the recent ones
+        with self._base_cache_lock:
+            base = self._base_cache.get(oid)
+            if base is not None:
+                self._base_cache.move_to_end(oid)
+                return base
+        base = self.read(oid)
+        assert base is not None, f"Missing delta base {oid}"
+        with self._base_cache_lock:
+            if oid not in self._base_cache:
+                self._base_cache[oid] = base
+                self._base_cache_size += len(base)
+            while self._base_cache_size > BASE_CACHE_SIZE and len(self._base_cache) > 1:
+                _, evicted = self._base_cache.popitem(last=False)
+                self._base_cache_size -= len(evicted)
+        return base
+
+    def iter_oids(self):
+        for i in range(self.count):
+            yield self.oid_at(i)
+
+    def close(self):
+        self._index.close()
+        self._pack.close()
+
+
+def _decode_record(kind, record, read_base):
+    if kind == OBJ_RAW:
+        return record
+    if kind == OBJ_FULL:
+        return _codec.decompress(record)
+    if kind == OBJ_REF_DELTA:
+        base = read_base(record[:OID_SIZE].hex())
+        return _delta.apply_delta(base, _codec.decompress(record[OID_SIZE:]))
+    assert False, f"Unknown pack record {kind}"
+
+def _map(path):
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def load_packs(pack_dir):
+    if not os.path.isdir(pack_dir):
+        return []
+    return [
+        Pack(f"{pack_dir}/{name}")
+        for name in sorted(os.listdir(pack_dir))
+        if name.startswith('pack-') and name.endswith('.idx')
+    ]
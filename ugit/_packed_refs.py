@@ -0,0 +1,66 @@
+import os
+import mmap
+
+# One "<oid> <refname>" line per ref, sorted by refname, so a single ref is
+# found by binary search and all refs under a prefix are one contiguous run
+HEADER = b'# pack-refs with: sorted\n'
+
+
+def write(path, refs):
+    # refs: {refname: oid}
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER)
+        for refname in sorted(refs):
+            f.write(f"{refs[refname]} {refname}\n".encode())
+    os.replace(tmp_path, path)
+
+
+class PackedRefs:
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        assert self._map[:len(HEADER)] == HEADER, f"Bad packed refs file {path}"
+        self._start = len(HEADER)
+
+    def get(self, refname):
+        key = refname.encode()
+        pos = self._lower_bound(key)
+        if pos < len(self._map):
+            name, oid, _ = self._line(pos)
+            if name == key:
+                return oid
+        return None
+
+    def iter(self, prefix=''):
+        key = prefix.encode()
+        pos = self._lower_bound(key)
+        while pos < len(self._map):
+            name, oid, pos = self._line(pos)
+            if not name.startswith(key):
+                return
+            yield name.decode(), oid
+
+    def _lower_bound(self, key):
+        # Start of the first line whose refname is not below key. lo and hi
+        # always point at line starts; mid is moved back to the start of its
+        # line.
+        lo, hi = self._start, len(self._map)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self._map.rfind(b'\n', lo, mid) + 1 or lo
+            name, _, end = self._line(start)
+            if name < key:
+                lo = end
+            else:
+                hi = start
+        return lo
+
+    def _line(self, pos):
+        end = self._map.find(b'\n', pos)
+        line = self._map[pos:end]
+        return line[41:], line[:40].decode(), end + 1
+
+    def close(self):
+        self._map.close()
@@ -2,46 +2,66 @@ import os
 
 from . import data
 from . import base
+from . import _transport
 
 REMOTE_REFS_BASE = 'refs/heads/'
 LOCAL_REFS_BASE = 'refs/remote/'
+SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
 
-def fetch(remote_path):
-    # print("Will fetch the following refs:")
-    # for refname, _ in _get_remote_refs(remote_path, 'refs/heads'):
-    #     print(f'- {refname}')
-    # Get refs from server
-    refs = _get_remote_refs(remote_path, REMOTE_REFS_BASE)
-    # Fetch missing objects by iterating and fetching on demand
-    for oid in base.iter_objects_in_commits(refs.values()):
-        data.fetch_object_if_missing(oid, remote_path)
+def parse_filter(spec):
+    # blob:none or blob:limit=<size>[kmg], as the size from which blobs are
+    # left out
+    if spec == 'blob:none':
+        return 0
+    kind, _, size = spec.partition('=')
+    assert kind == 'blob:limit', f"Unsupported filter {spec}"
+    unit = size[-1:].lower() if size[-1:].isalpha() else ''
+    number = size[:len(size) - len(unit)]
+    assert number.isdigit() and unit in SIZE_UNITS, f"Bad size in filter {spec}"
+    return int(number) * SIZE_UNITS[unit]
+
+def fetch(remote_path, filter_spec=None):
+    # A filtered fetch makes this a partial clone of the remote: objects it
+    # left out are fetched from it when they are first read
+    blob_limit = parse_filter(filter_spec) if filter_spec else None
+    with _transport.connect(remote_path) as connection:
+        # Get refs from server
+        refs = _transport.ls_refs(connection, REMOTE_REFS_BASE)
+        # Having a commit means having everything reachable from it, or in
+        # a partial clone having it promised
+        wants = {oid for oid in refs.values() if not data.object_exists(oid)}
+        if wants:
+            local_tips = {ref.value for _, ref in data.iter_refs()}
+            haves = _transport.negotiate(connection, local_tips)
+            _transport.fetch_pack(connection, wants, haves, blob_limit)
+    # Only once the filtered objects are here is this a partial clone
+    if blob_limit is not None:
+        data.set_promisor_remote(_location(remote_path))
 
     # Update local refs to match server
     for remote_name, value in refs.items():
         refname = os.path.relpath(remote_name, REMOTE_REFS_BASE)
         data.update_ref(f"{LOCAL_REFS_BASE}/{refname}", data.RefValue(symbolic=False, value=value))
 
-def _get_remote_refs(remote_path, prefix = ''):
-    with data.change_git_dir(remote_path):
-        return {refname : ref.value for refname, ref in data.iter_refs(prefix)}
+def fetch_objects(remote_path, oids):
+    with _transport.connect(remote_path) as connection:
+        _transport.fetch_objects(connection, oids)
+
+def _location(remote_path):
+    # Lazy fetches may run from anywhere in the working tree
+    if remote_path.startswith(_transport.SOCKET_PREFIX):
+        return remote_path
+    return os.path.abspath(remote_path)
 
 def push(remote_path, refname):
-    remote_refs = _get_remote_refs(remote_path)
-    remote_ref = remote_refs.get(refname)
     local_ref = data.get_ref(refname).value
     assert local_ref
 
-    assert not remote_ref or base.is_ancestor_of(local_ref, remote_ref)
-
-    # Compute which objects the server doesn't have
-    known_remote_refs = filter(data.object_exists, remote_refs.values())
-    remote_objects = set(base.iter_objects_in_commits(known_remote_refs))
-    local_objects = set(base.iter_objects_in_commits({local_ref}))
-    objects_to_push = local_objects - remote_objects
+    with _transport.connect(remote_path) as connection:
+        remote_refs = _transport.ls_refs(connection)
+        remote_ref = remote_refs.get(refname)
+        assert not remote_ref or base.is_ancestor_of(local_ref, remote_ref)
 
-    # objects_to_push = base.iter_objects_in_commits({local_ref})
-    for oid in objects_to_push:
-        data.push_object(oid, remote_path)
-    
-    with data.change_git_dir(remote_path):
-        data.update_ref(refname, data.RefValue(symbolic=False, value=local_ref))
\ No newline at end of file
+        # Compute which objects the server doesn't have
+        known_remote_refs = set(filter(data.object_exists, remote_refs.values()))
+        _transport.push_pack(connection, refname, remote_ref, local_ref, known_remote_refs)
@@ -0,0 +1,147 @@
+import os
+import heapq
+
+from collections import Counter, defaultdict, namedtuple
+
+# Minimum similarity, in percent, for a delete and an add to count as a rename
+THRESHOLD = int(os.environ.get('UGIT_RENAME_THRESHOLD', 50))
+# Most pairs whose contents are compared in full; past it only exact renames
+# are found
+LIMIT = int(os.environ.get('UGIT_RENAME_LIMIT', 10000))
+# Sources compared in full for each added file, best candidates first
+CANDIDATES = 4
+# Chunks shared by more sources than this say nothing about which one a file
+# came from and are left out of the candidate ranking
+COMMON_CHUNK = 32
+MAX_CHUNK = 64
+
+Rename = namedtuple('Rename', ['old_path', 'path', 'o_from', 'o_to', 'similarity', 'copy'])
+
+
+def find_renames(changes, read_from, read_to, threshold=THRESHOLD, limit=LIMIT, copies=False, old_tree=None):
+    # Pairs deleted files (or, with copies, any old file that changed) with
+    # added files. Returns the changes sorted by path, with paired files
+    # replaced by one Rename each. With copies, the unchanged files of
+    # old_tree (path -> oid) are sources too, but only of exact copies:
+    # comparing them all would read the whole tree.
+    changes = list(changes)
+    deleted = {path: o_from for path, o_from, o_to in changes if o_from and not o_to}
+    added = {path: o_to for path, o_from, o_to in changes if o_to and not o_from}
+    if not added or not (deleted or copies):
+        return changes
+    sources = dict(deleted)
+    if copies:
+        sources.update((path, o_from) for path, o_from, o_to in changes if o_from and o_to)
+    exact_sources = dict(sources)
+    if copies and old_tree:
+        changed = {change[0] for change in changes}
+        exact_sources.update((path, oid) for path, oid in old_tree.items() if path not in changed)
+
+    pairs = _exact_pairs(exact_sources, added, deleted, copies)
+    remaining = [path for path in added if path not in pairs]
+    used = {old_path for old_path, _ in pairs.values()}
+    unused = [path for path in sources if copies or path not in used]
+    if remaining and unused:
+        pairs.update(_similar_pairs(
+            sources, added, unused, remaining, read_from, read_to, threshold, limit, reuse=copies,
+        ))
+
+    renamed = set()
+    result = []
+    # A source is renamed once, to the destination that sorts first; other
+    # destinations and sources that still exist become copies
+    for path in sorted(pairs):
+        old_path, similarity = pairs[path]
+        copy = old_path in renamed or old_path not in deleted
+        if not copy:
+            renamed.add(old_path)
+        elif not copies:
+            continue
+        result.append(Rename(old_path, path, exact_sources[old_path], added[path], similarity, copy))
+    paired = {rename.path for rename in result}
+    result += [
+        change for change in changes
+        if change[0] not in paired and change[0] not in renamed
+    ]
+    return sorted(result, key=lambda change: change.path if isinstance(change, Rename) else change[0])
+
+def _exact_pairs(sources, added, deleted, copies):
+    by_oid = defaultdict(list)
+    for path, oid in sources.items():
+        by_oid[oid].append(path)
+    used = set()
+    pairs = {}
+    for path, oid in added.items():
+        candidates = [old for old in by_oid.get(oid, ()) if old not in used or copies]
+        if not candidates:
+            continue
+        # Prefer a deleted source with the same name, as when a directory
+        # moves, over one that is still there
+        name = os.path.basename(path)
+        old_path = min(candidates, key=lambda old: (old in used, old not in deleted, os.path.basename(old) != name))
+        used.add(old_path)
+        pairs[path] = (old_path, 100)
+    return pairs
+
+def _similar_pairs(sources, added, unused, remaining, read_from, read_to, threshold, limit, reuse):
+    fingerprints = {path: fingerprint(read_from(path, sources[path])) for path in unused}
+    sizes = {path: sum(chunks.values()) for path, chunks in fingerprints.items()}
+    # chunk -> sources containing it, to rank candidates without comparing
+    # every pair
+    index = defaultdict(list)
+    for path, chunks in fingerprints.items():
+        for chunk in chunks:
+            index[chunk].append(path)
+
+    scored = []
+    budget = limit
+    for path in remaining:
+        if budget <= 0:
+            break
+        chunks = fingerprint(read_to(path, added[path]))
+        size = sum(chunks.values())
+        shared = Counter()
+        for chunk, count in chunks.items():
+            holders = index.get(chunk, ())
+            if len(holders) > COMMON_CHUNK:
+                continue
+            for source in holders:
+                shared[source] += min(count, fingerprints[source][chunk])
+        for source, _ in heapq.nlargest(CANDIDATES, shared.items(), key=lambda item: item[1]):
+            if min(size, sizes[source]) * 100 < threshold * max(size, sizes[source]):
+                continue
+            budget -= 1
+            similarity = _similarity(fingerprints[source], chunks, sizes[source], size)
+            if similarity >= threshold:
+                scored.append((-similarity, path, source))
+
+    # Best matches first; each destination gets one source and, unless
+    # copies are wanted, each source one destination
+    pairs = {}
+    used = set()
+    for similarity, path, source in sorted(scored):
+        if path in pairs or (source in used and not reuse):
+            continue
+        used.add(source)
+        pairs[path] = (source, -similarity)
+    return pairs
+
+def _similarity(source, target, source_size, target_size):
+    largest = max(source_size, target_size)
+    if not largest:
+        return 100
+    common = sum(min(count, source[chunk]) for chunk, count in target.items() if chunk in source)
+    return common * 100 // largest
+
+def fingerprint(content):
+    # Bytes per chunk hash; chunks are lines, split further when longer than
+    # MAX_CHUNK so binary files and very long lines still compare
+    chunks = Counter()
+    start = 0
+    while start < len(content):
+        end = content.find(b'\n', start, start + MAX_CHUNK)
+        end = start + MAX_CHUNK if end == -1 else end + 1
+        chunk = content[start:end]
+        chunks[hash(chunk)] += len(chunk)
+        start = end
+    return chunks
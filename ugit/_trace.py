@@ -0,0 +1,212 @@
+import os
+import sys
+import time
+import inspect
+import importlib
+import threading
+import functools
+import orjson
+
+from collections import defaultdict
+
+# Tracing is off unless UGIT_TRACE or --trace is given. Nothing is wrapped
+# until then, so an untraced run pays nothing. 'summary' (or '1') prints call
+# counts, bytes and wall time per traced function to stderr; any other value
+# is a file to write Chrome trace-event JSON to (chrome://tracing, Perfetto).
+
+# (module, attribute, span name, what to count as bytes): 'result' counts the
+# length of the returned bytes, 'content' of the content in a returned
+# (type, content), 'arg' the length of the first argument and 'connection'
+# what went over the connection given as the first argument
+TARGETS = [
+    ('data', 'get_object', 'data.get_object', 'result'),
+    ('data', 'get_typed_object', 'data.get_typed_object', 'content'),
+    ('data', 'hash_object', 'data.hash_object', 'arg'),
+    ('data', 'hash_file', 'data.hash_file', None),
+    ('data', 'get_ref', 'data.get_ref', None),
+    ('data', 'update_ref', 'data.update_ref', None),
+    ('data', 'iter_refs', 'data.iter_refs', None),
+    ('_index.Index', '__init__', 'index.read', None),
+    ('_index.Index', 'write', 'index.write', None),
+    ('base', 'get_tree', 'base.get_tree', None),
+    ('base', 'iter_tree_changes', 'base.iter_tree_changes', None),
+    ('base', 'get_working_tree', 'base.get_working_tree', None),
+    ('base', '_checkout_index', 'base.checkout_index', None),
+    ('base', 'merge_trees', 'base.merge_trees', None),
+    ('data', 'write_pack_stream', 'data.write_pack_stream', None),
+    ('data', 'receive_pack_stream', 'data.receive_pack_stream', None),
+    ('_transport', 'ls_refs', 'transport.ls_refs', 'connection'),
+    ('_transport', 'negotiate', 'transport.negotiate', 'connection'),
+    ('_transport', 'fetch_pack', 'transport.fetch_pack', 'connection'),
+    ('_transport', 'push_pack', 'transport.push_pack', 'connection'),
+    ('_transport', 'fetch_objects', 'transport.fetch_objects', 'connection'),
+    ('_remote', 'fetch', 'remote.fetch', None),
+    ('_remote', 'push', 'remote.push', None),
+]
+
+_tracer = None
+# (target, attribute, original) for everything wrapped, to undo it
+_wrapped = []
+
+
+class Tracer:
+
+    def __init__(self, output):
+        self.output = output
+        self.start_ns = time.perf_counter_ns()
+        self.events = []
+        self.calls = defaultdict(int)
+        self.time_ns = defaultdict(int)
+        self.bytes = defaultdict(int)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def enter(self, name):
+        # Recursive calls are counted but their time is only added once
+        depth = self._depth()
+        depth[name] = depth.get(name, 0) + 1
+        return time.perf_counter_ns()
+
+    def exit(self, name, start_ns, size=0):
+        end_ns = time.perf_counter_ns()
+        depth = self._depth()
+        depth[name] -= 1
+        with self._lock:
+            self.calls[name] += 1
+            self.bytes[name] += size
+            if not depth[name]:
+                self.time_ns[name] += end_ns - start_ns
+            if self.output != 'summary':
+                self.events.append({
+                    'name': name, 'cat': 'ugit', 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                    'ts': (start_ns - self.start_ns) / 1000, 'dur': (end_ns - start_ns) / 1000,
+                    'args': {'bytes': size} if size else {},
+                })
+
+    def _depth(self):
+        depth = getattr(self._local, 'depth', None)
+        if depth is None:
+            depth = self._local.depth = {}
+        return depth
+
+    def finish(self, counters):
+        if self.output == 'summary':
+            self._print_summary(counters)
+            return
+        with open(self.output, 'wb') as f:
+            f.write(orjson.dumps({
+                'traceEvents': self.events,
+                'displayTimeUnit': 'ms',
+                'otherData': counters,
+            }))
+
+    def _print_summary(self, counters):
+        total_ns = time.perf_counter_ns() - self.start_ns
+        out = sys.stderr
+        print(f"\n{'span':<28} {'calls':>9} {'time (ms)':>11} {'bytes':>12}", file=out)
+        for name in sorted(self.calls, key=lambda name: -self.time_ns[name]):
+            size = self.bytes[name] or ''
+            print(f"{name:<28} {self.calls[name]:>9} {self.time_ns[name] / 1e6:>11.2f} {size:>12}", file=out)
+        for name, value in counters.items():
+            print(f"{name:<28} {value:>9}", file=out)
+        print(f"{'total':<28} {'':>9} {total_ns / 1e6:>11.2f}", file=out)
+
+
+def _wrap(function, name, measure):
+    if inspect.isgeneratorfunction(function):
+        @functools.wraps(function)
+        def traced_generator(*args, **kwargs):
+            start_ns = _tracer.enter(name)
+            try:
+                yield from function(*args, **kwargs)
+            finally:
+                _tracer.exit(name, start_ns)
+        return traced_generator
+
+    @functools.wraps(function)
+    def traced(*args, **kwargs):
+        start_ns = _tracer.enter(name)
+        size = 0
+        if measure == 'connection':
+            size = -_transferred(args[0])
+        try:
+            result = function(*args, **kwargs)
+            if measure == 'result' and isinstance(result, bytes):
+                size = len(result)
+            elif measure == 'content':
+                size = len(result[1])
+            elif measure == 'arg' and args and isinstance(args[0], bytes):
+                size = len(args[0])
+            return result
+        finally:
+            if measure == 'connection':
+                size += _transferred(args[0])
+            _tracer.exit(name, start_ns, size)
+    return traced
+
+def _transferred(connection):
+    return connection.bytes_sent + connection.bytes_received
+
+def span(name):
+    # For phases that are not a function of their own; a no-op when off
+    return _Span(name) if _tracer else _NO_SPAN
+
+
+class _Span:
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start_ns = _tracer.enter(self.name)
+
+    def __exit__(self, *exc):
+        _tracer.exit(self.name, self.start_ns)
+
+
+class _NoSpan:
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+_NO_SPAN = _NoSpan()
+
+
+def enable(output):
+    global _tracer
+    if _tracer is not None:
+        return
+    if output in ('1', 'summary'):
+        output = 'summary'
+    _tracer = Tracer(output)
+    for owner, attribute, name, measure in TARGETS:
+        module, *path = owner.split('.')
+        target = importlib.import_module(f"{__package__}.{module}")
+        for part in path:
+            target = getattr(target, part)
+        original = getattr(target, attribute)
+        _wrapped.append((target, attribute, original))
+        setattr(target, attribute, _wrap(original, name, measure))
+
+def enable_from_env():
+    output = os.environ.get('UGIT_TRACE')
+    if output and output != '0':
+        enable(output)
+
+def finish():
+    global _tracer
+    if _tracer is None:
+        return
+    from . import data
+    counters = {
+        'object_cache.hits': data.object_cache.hits,
+        'object_cache.misses': data.object_cache.misses,
+    }
+    for target, attribute, original in reversed(_wrapped):
+        setattr(target, attribute, original)
+    _wrapped.clear()
+    tracer, _tracer = _tracer, None
+    tracer.finish(counters)
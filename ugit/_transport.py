@@ -0,0 +1,257 @@
+import os
+import sys
+import socket
+import struct
+import orjson
+import subprocess
+
+from collections import deque
+from contextlib import contextmanager
+
+from . import data
+from . import base
+
+# Messages are length-prefixed JSON frames. Object data never goes through
+# them: a fetch or push is followed by one pack stream on the same pipe.
+# Chunks of chunked blobs aren't reachable from trees, so before a pack is
+# sent the two sides agree on which of them the receiver is missing.
+FRAME = struct.Struct('>I')
+SOCKET_PREFIX = 'unix://'
+HAVES_PER_ROUND = 32
+MAX_HAVES = 1024
+
+
+class Connection:
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = CountingWriter(writer)
+        self.round_trips = 0
+        self.bytes_received = 0
+
+    def send(self, message):
+        payload = orjson.dumps(message)
+        self.writer.write(FRAME.pack(len(payload)) + payload)
+        self.writer.flush()
+
+    def recv(self):
+        header = self.reader.read(FRAME.size)
+        if not header:
+            return None
+        size, = FRAME.unpack(header)
+        payload = self.reader.read(size)
+        assert len(payload) == size, "Truncated message"
+        self.bytes_received += FRAME.size + size
+        return orjson.loads(payload)
+
+    def request(self, message):
+        self.send(message)
+        return self.response()
+
+    def response(self):
+        self.round_trips += 1
+        response = self.recv()
+        assert response is not None, "Remote hung up"
+        assert 'error' not in response, response['error']
+        return response
+
+    @property
+    def bytes_sent(self):
+        return self.writer.count
+
+
+class CountingWriter:
+
+    def __init__(self, writer):
+        self._writer = writer
+        self.count = 0
+
+    def write(self, data):
+        self.count += len(data)
+        return self._writer.write(data)
+
+    def flush(self):
+        self._writer.flush()
+
+
+class CountingReader:
+
+    def __init__(self, reader, connection):
+        self._reader = reader
+        self._connection = connection
+
+    def read(self, size):
+        data = self._reader.read(size)
+        self._connection.bytes_received += len(data)
+        return data
+
+
+@contextmanager
+def connect(remote):
+    if remote.startswith(SOCKET_PREFIX):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(remote[len(SOCKET_PREFIX):])
+            with sock.makefile('rb') as reader, sock.makefile('wb') as writer:
+                yield Connection(reader, writer)
+        return
+
+    # Run the server from the same ugit the client is using
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [package_root, env.get('PYTHONPATH')]))
+    # The server would write its trace over the client's
+    env.pop('UGIT_TRACE', None)
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'ugit.cli', 'serve'],
+        cwd=remote, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+    )
+    try:
+        yield Connection(proc.stdout, proc.stdin)
+    finally:
+        proc.stdin.close()
+        proc.wait()
+        proc.stdout.close()
+
+
+def ls_refs(connection, prefix=''):
+    return connection.request({'command': 'ls-refs', 'prefix': prefix})['refs']
+
+def negotiate(connection, tips):
+    # Walk local history newest first, asking the server which commits it has.
+    # Ancestors of a commit it has are common too and are never sent.
+    common = set()
+    queue = deque(tips)
+    seen = set()
+    sent = 0
+    while queue and sent < MAX_HAVES:
+        batch = []
+        while queue and len(batch) < HAVES_PER_ROUND:
+            oid = queue.popleft()
+            if oid and oid not in seen:
+                seen.add(oid)
+                batch.append(oid)
+        if not batch:
+            break
+        sent += len(batch)
+        acked = set(connection.request({'command': 'have', 'haves': batch})['common'])
+        common |= acked
+        for oid in batch:
+            if oid not in acked:
+                queue.extend(base.get_commit_parents(oid))
+    return common
+
+def fetch_pack(connection, wants, haves, blob_limit=None):
+    # With blob_limit, blobs of that many bytes or more are left out, all of
+    # them for 0
+    message = {'command': 'fetch', 'wants': sorted(wants), 'haves': sorted(haves)}
+    if blob_limit is not None:
+        message['blob_limit'] = blob_limit
+    _receive_pack(connection, message)
+
+def fetch_objects(connection, oids):
+    _receive_pack(connection, {'command': 'fetch-objects', 'oids': sorted(oids)})
+
+def _receive_pack(connection, message):
+    chunks = connection.request(message)['chunks']
+    connection.send({'missing': [oid for oid in chunks if not data.object_exists(oid)]})
+    connection.round_trips += 1
+    data.receive_pack_stream(CountingReader(connection.reader, connection))
+
+def push_pack(connection, refname, old, new, haves):
+    oids = list(base.iter_objects_to_send({new}, haves))
+    # A partial clone gets what it left out in one round trip, not one each
+    data.prefetch_objects(oids)
+    chunks = _chunks_of(oids)
+    if chunks:
+        present = set(connection.request({'command': 'have', 'haves': chunks})['common'])
+        oids.extend(oid for oid in chunks if oid not in present)
+    connection.send({'command': 'push', 'ref': refname, 'old': old, 'new': new})
+    data.write_pack_stream(connection.writer, oids)
+    connection.response()
+
+def _send_pack(connection, oids):
+    oids = list(oids)
+    connection.send({'chunks': _chunks_of(oids)})
+    reply = connection.recv()
+    assert reply is not None, "Remote hung up"
+    data.write_pack_stream(connection.writer, oids + reply['missing'])
+
+def _chunks_of(oids):
+    sent = set(oids)
+    chunks = set()
+    for oid in oids:
+        chunks.update(data.get_chunk_oids(oid) or ())
+    return sorted(chunks - sent)
+
+
+def serve(reader, writer):
+    # Refs and packs may have changed since the last connection, also by a
+    # repack in another process
+    data.drop_caches()
+    connection = Connection(reader, writer)
+    while True:
+        try:
+            message = connection.recv()
+            if message is None:
+                return
+            response = _handle(connection, message)
+        except ConnectionError:
+            return
+        except Exception as e:
+            # The client fails its command, the server keeps serving
+            response = {'error': _error_message(e)}
+        if response is not None:
+            try:
+                connection.send(response)
+            except ConnectionError:
+                return
+
+def _error_message(e):
+    if isinstance(e, AssertionError):
+        return str(e)
+    return f"{type(e).__name__}: {e}"
+
+def serve_socket(path):
+    # Left behind by a server that was killed
+    if os.path.exists(path):
+        os.remove(path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(path)
+        server.listen()
+        try:
+            while True:
+                sock, _ = server.accept()
+                try:
+                    with sock, sock.makefile('rb') as reader, sock.makefile('wb') as writer:
+                        serve(reader, writer)
+                except ConnectionError:
+                    # Gone before everything was flushed to it
+                    pass
+        finally:
+            os.remove(path)
+
+def _handle(connection, message):
+    command = message['command']
+    if command == 'ls-refs':
+        return {'refs': {refname: ref.value for refname, ref in data.iter_refs(message['prefix'])}}
+    if command == 'have':
+        return {'common': [oid for oid in message['haves'] if data.object_exists(oid)]}
+    if command == 'fetch':
+        _send_pack(connection, base.iter_objects_to_send(message['wants'], message['haves'], message.get('blob_limit')))
+        return None
+    if command == 'fetch-objects':
+        missing = [oid for oid in message['oids'] if not data.object_exists(oid)]
+        assert not missing, f"Unknown objects {', '.join(missing)}"
+        _send_pack(connection, message['oids'])
+        return None
+    if command == 'push':
+        # The pack is read before anything is checked to keep the stream in sync
+        data.receive_pack_stream(connection.reader)
+        current = data.get_ref(message['ref']).value
+        assert current == message['old'], f"{message['ref']} moved on the remote, fetch first"
+        assert not current or base.is_ancestor_of(message['new'], current), "Not a fast-forward"
+        missing = list(base.iter_missing_objects({message['new']}, {current}))
+        assert not missing, f"Push is missing objects {', '.join(missing[:10])}"
+        data.update_ref(message['ref'], data.RefValue(symbolic=False, value=message['new']))
+        return {'ok': True}
+    assert False, f"Unknown command {command}"
@@ -1,14 +1,28 @@
 import os
+import stat
 import itertools
+import heapq
 import operator
 import string
 
 from collections import namedtuple, deque
-from pathlib import Path
 
 
 from . import data
 from . import _diff
+from . import _bitmap
+from . import _fsmonitor
+
+BITMAP_INTERVAL = 100
+# Memory taken by parsed objects in the object cache beyond their raw
+# size: a tuple and three strings per tree entry, a Commit and its strings
+PARSED_TREE_ENTRY_SIZE = 200
+PARSED_COMMIT_SIZE = 400
+CHECKOUT_WORKERS = int(os.environ.get('UGIT_CHECKOUT_WORKERS', 1))
+# Shortest abbreviated oid accepted, and most candidates listed when one is
+# ambiguous
+MIN_ABBREV = 4
+AMBIGUOUS_SHOWN = 10
 
 
 def init():
@@ -36,16 +50,26 @@ def init():
 #     return data.hash_object(tree.encode(), 'tree')
 
 def write_tree():
-    index_as_tree = {}
     with data.get_index() as index:
-        for path, oid in index.items():
-            path = path.split('/')
-            dirpath, filename = path[:-1], path[-1]
-            current = index_as_tree
-
-            for dirname in dirpath:
-                current = current.setdefault(dirname, {})
-            current[filename] = oid
+        return _write_index_tree(index)
+
+def get_index_tree_oid():
+    # The oid of the tree the index would commit, and its tree entries by oid:
+    # the trees are only hashed, not written
+    trees = {}
+    with data.get_index() as index:
+        return _write_index_tree(index, trees), trees
+
+def _write_index_tree(index, trees=None):
+    index_as_tree = {}
+    for path, entry in index.items():
+        path = path.split('/')
+        dirpath, filename = path[:-1], path[-1]
+        current = index_as_tree
+
+        for dirname in dirpath:
+            current = current.setdefault(dirname, {})
+        current[filename] = entry.oid
     
     def write_tree_recursive(tree_dict):
         entries = []
@@ -57,20 +81,27 @@ def write_tree():
                 type_ = 'blob'
                 oid = value
             entries.append((name, oid, type_))
+        entries.sort()
         tree = ''.join(
-            f"{type_} {oid} {name}\n" for name, oid, type_ in sorted(entries)
+            f"{type_} {oid} {name}\n" for name, oid, type_ in entries
         )
-        return data.hash_object(tree.encode(), 'tree')
+        oid = data.hash_object(tree.encode(), 'tree', write=trees is None)
+        if trees is not None:
+            trees[oid] = [(type_, oid_, name) for name, oid_, type_ in entries]
+        return oid
     
     return write_tree_recursive(index_as_tree)
 
 def _iter_tree_entries(oid):
     if not oid:
         return
-    tree = data.get_object(oid, 'tree')
-    for entry in tree.decode().splitlines():
-        type_, oid, name = entry.split(' ', 2)
-        yield type_, oid, name
+    key = data.cache_key('tree', oid)
+    entries = data.object_cache.get(key)
+    if entries is None:
+        tree = data.get_object(oid, 'tree')
+        entries = [tuple(entry.split(' ', 2)) for entry in tree.decode().splitlines()]
+        data.object_cache.put(key, entries, len(tree) + len(entries) * PARSED_TREE_ENTRY_SIZE)
+    yield from entries
 
 def get_tree(oid, base_path=''):
     result = {}
@@ -86,61 +117,260 @@ def get_tree(oid, base_path=''):
             assert False, f"Unknown tree entry {type_}"
     return result
 
+def iter_tree_changes(t_from, t_to, trees=None, base_path=''):
+    # (path, o_from, o_to) for every blob that differs between two trees. Both
+    # trees are walked together and subtrees with equal oids are never read.
+    # trees holds entries of trees that only exist in memory.
+    if t_from == t_to:
+        return
+    entries_from = _sorted_tree_entries(t_from, trees)
+    entries_to = _sorted_tree_entries(t_to, trees)
+    i = j = 0
+    while i < len(entries_from) or j < len(entries_to):
+        name_from = entries_from[i][2] if i < len(entries_from) else None
+        name_to = entries_to[j][2] if j < len(entries_to) else None
+        if name_to is None or (name_from is not None and name_from < name_to):
+            type_, oid, name = entries_from[i]
+            i += 1
+            yield from _iter_one_sided(type_, oid, base_path + name, trees, removed=True)
+        elif name_from is None or name_to < name_from:
+            type_, oid, name = entries_to[j]
+            j += 1
+            yield from _iter_one_sided(type_, oid, base_path + name, trees, removed=False)
+        else:
+            type_from, o_from, name = entries_from[i]
+            type_to, o_to, _ = entries_to[j]
+            i += 1
+            j += 1
+            path = base_path + name
+            if o_from == o_to and type_from == type_to:
+                continue
+            if type_from == type_to == 'tree':
+                yield from iter_tree_changes(o_from, o_to, trees, f'{path}/')
+            elif type_from == type_to == 'blob':
+                yield path, o_from, o_to
+            else:
+                yield from _iter_one_sided(type_from, o_from, path, trees, removed=True)
+                yield from _iter_one_sided(type_to, o_to, path, trees, removed=False)
+
+def _iter_one_sided(type_, oid, path, trees, removed):
+    if type_ == 'blob':
+        yield (path, oid, None) if removed else (path, None, oid)
+        return
+    for type_, oid, name in _sorted_tree_entries(oid, trees):
+        yield from _iter_one_sided(type_, oid, f'{path}/{name}', trees, removed)
+
+def _sorted_tree_entries(oid, trees):
+    if trees and oid in trees:
+        entries = trees[oid]
+    else:
+        entries = _iter_tree_entries(oid)
+    return sorted(entries, key=lambda entry: entry[2])
+
 def get_working_tree():
+    # With a running fsmonitor only the paths it reports are looked at; the
+    # rest is known from the index and from what the last scan saw differ
+    # from it. Any change to the index forces a full scan.
+    state = data.get_fsmonitor_state()
+    changes = _fsmonitor.query(data.GIT_DIR, state and state['token'])
     result = {}
-    for root, _, filenames in os.walk('.'):
+    with data.get_index() as index:
+        index_mtime = data.get_index_mtime()
+        matcher = data.get_ignore_matcher()
+        if _can_use_fsmonitor(state, changes):
+            result = {path: entry.oid for path, entry in index.items()}
+            for path, oid in state['extra'].items():
+                if oid is None:
+                    result.pop(path, None)
+                else:
+                    result[path] = oid
+            paths = set(changes.paths)
+            for dirname in changes.dirs:
+                prefix = f"{dirname}/"
+                paths.update(path for path in result if path.startswith(prefix))
+                paths.update(_walk_working_files(dirname, matcher))
+            for path in paths:
+                result.pop(path, None)
+                if not matcher.is_ignored(path):
+                    _scan_working_file(path, index, index_mtime, result)
+        else:
+            for path in _walk_working_files('.', matcher):
+                _scan_working_file(path, index, index_mtime, result)
+
+        if changes is not None:
+            extra = {path: oid for path, oid in result.items() if path not in index or index[path].oid != oid}
+            extra.update((path, None) for path in index if path not in result)
+    if changes is not None:
+        data.set_fsmonitor_state({'token': changes.token, 'index': data.get_index_signature(), 'extra': extra})
+    return result
+
+def _can_use_fsmonitor(state, changes):
+    return (
+        state is not None and changes is not None and changes.paths is not None and
+        state['index'] == data.get_index_signature() and
+        '.ugitignore' not in changes.paths
+    )
+
+def _walk_working_files(top, matcher):
+    for root, dirnames, filenames in os.walk(top):
+        _prune_ignored(root, dirnames, matcher)
         for filename in filenames:
             path = os.path.relpath(f"{root}/{filename}")
-            if is_ignored(path) or not os.path.isfile(path):
-                continue
-            with open(path, 'rb') as f:
-                result[path] = data.hash_object(f.read())
-    return result
+            if not matcher.match(path):
+                yield path
+
+def _scan_working_file(path, index, index_mtime, result):
+    st = _stat_file(path)
+    if st is None:
+        return
+    entry = index.get(path)
+    if entry and data.is_entry_clean(entry, st, index_mtime):
+        result[path] = entry.oid
+        return
+    oid = data.hash_file(path, write=False)
+    if entry and entry.oid == oid:
+        # Refresh the stat data so the next scan can skip hashing.
+        # A racy entry needs the index rewritten even when its
+        # stat data is unchanged.
+        index[path] = data.index_entry(oid, st)
+        index.dirty = True
+    result[path] = oid
+
+def _stat_file(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st if stat.S_ISREG(st.st_mode) else None
 
 def get_index_tree():
     with data.get_index() as index:
-        return index
-
-def _empty_current_directory():
-    for root, dirnames, filenames in os.walk('.', topdown=False):
-        for filename in filenames:
-            path = os.path.relpath(f'{root}/{filename}')
-            if is_ignored(path) or not os.path.isfile(path):
-                continue
-            os.remove(path)
-        for dirname in dirnames:
-            path = os.path.relpath(f'{root}/{dirname}')
-            if is_ignored(path):
-                continue
-            try:
-                os.rmdir(path)
-            except (FileNotFoundError, OSError):
-                pass
+        return {path: entry.oid for path, entry in index.items()}
 
 def read_tree(tree_oid, update_working= False):
     with data.get_index() as index:
-        index.clear()
-        index.update(get_tree(tree_oid))
-        if update_working:
-            _checkout_index(index)
+        _read_tree_into_index(index, get_tree(tree_oid), update_working)
             
 def read_tree_merged(t_base, t_HEAD, t_other, update_working=True):
     with data.get_index() as index:
+        tree, conflicts = merge_trees(t_base, t_HEAD, t_other)
+        _read_tree_into_index(index, tree, update_working)
+    return conflicts
+
+def merge_trees(t_base, t_HEAD, t_other):
+    # Resolves everything it can by comparing oids, whole subtrees included;
+    # only blobs changed differently on both sides are merged line by line
+    tree = {}
+    conflicts = []
+    divergent = []
+    _merge_tree_entries(t_base, t_HEAD, t_other, '', tree, conflicts, divergent)
+
+    merged = _diff.merge_blobs_parallel([oids for _, _, oids in divergent])
+    for (path, kind, oids), (content, conflicted) in zip(divergent, merged):
+        tree[path] = data.hash_object(content)
+        if conflicted:
+            conflicts.append(_diff.Conflict(path, kind, *oids))
+    return tree, conflicts
+
+def _merge_tree_entries(t_base, t_HEAD, t_other, base_path, tree, conflicts, divergent):
+    sides = [
+        {name: (type_, oid) for type_, oid, name in _iter_tree_entries(t)}
+        for t in (t_base, t_HEAD, t_other)
+    ]
+    for name in sorted(set().union(*sides)):
+        path = base_path + name
+        e_base, e_HEAD, e_other = (side.get(name) for side in sides)
+        if e_HEAD == e_other or e_base == e_other:
+            _take_entry(e_HEAD, path, tree)
+            continue
+        if e_base == e_HEAD:
+            _take_entry(e_other, path, tree)
+            continue
+
+        types = {entry[0] for entry in (e_base, e_HEAD, e_other) if entry}
+        o_base, o_HEAD, o_other = (entry and entry[1] for entry in (e_base, e_HEAD, e_other))
+        both_trees = e_HEAD and e_other and e_HEAD[0] == e_other[0] == 'tree'
+        if types == {'tree'} or both_trees:
+            # A file the base had where both sides now have a directory has
+            # no part in merging them
+            if e_base and e_base[0] != 'tree':
+                o_base = None
+            _merge_tree_entries(o_base, o_HEAD, o_other, f'{path}/', tree, conflicts, divergent)
+        elif types != {'blob'}:
+            conflicts.append(_diff.Conflict(path, 'file/directory', o_base, o_HEAD, o_other))
+            _take_entry(e_HEAD, path, tree)
+        elif not e_HEAD or not e_other:
+            # Keep the modified side
+            conflicts.append(_diff.Conflict(path, 'modify/delete', o_base, o_HEAD, o_other))
+            _take_entry(e_HEAD or e_other, path, tree)
+        else:
+            kind = 'content' if e_base else 'add/add'
+            divergent.append((path, kind, (o_base, o_HEAD, o_other)))
+
+def _take_entry(entry, path, tree):
+    if not entry:
+        return
+    type_, oid = entry
+    if type_ == 'tree':
+        tree.update(get_tree(oid, f'{path}/'))
+    else:
+        tree[path] = oid
+
+def _read_tree_into_index(index, tree, update_working):
+    if update_working:
+        _checkout_index(index, tree)
+    else:
         index.clear()
-        index.update(_diff.merge_trees(
-            get_tree(t_base),
-            get_tree(t_HEAD),
-            get_tree(t_other)
-        ))
-        if update_working:
-            _checkout_index(index)
-
-def _checkout_index(index):
-    _empty_current_directory()
-    for path, oid in index.items():
-        Path(path).parent.mkdir(parents=True, exist_ok=True)
-        with open(path, 'wb') as f:
-            f.write(data.get_object(oid, 'blob'))
+        index.update({path: data.index_entry(oid) for path, oid in tree.items()})
+
+def _checkout_index(index, tree, workers=None):
+    # Only touch paths that differ between the index and the target tree, or
+    # whose file was modified since it was last checked out or added
+    index_mtime = data.get_index_mtime()
+    removed = [path for path in index if path not in tree]
+    changed = []
+    for path, oid in tree.items():
+        entry = index.get(path)
+        st = entry and entry.oid == oid and _stat_file(path)
+        if not st or not data.is_entry_clean(entry, st, index_mtime):
+            changed.append((path, oid))
+    data.prefetch_objects(oid for _, oid in changed)
+
+    for path in removed:
+        del index[path]
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        _remove_empty_parents(path)
+
+    workers = workers or CHECKOUT_WORKERS
+    if workers > 1 and len(changed) > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(workers) as executor:
+            entries = list(executor.map(_checkout_file, changed))
+    else:
+        entries = [_checkout_file(item) for item in changed]
+    for (path, _), entry in zip(changed, entries):
+        index[path] = entry
+
+def _checkout_file(item):
+    path, oid = item
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    type_, _, pieces = data.stream_object(oid)
+    assert type_ == 'blob', f"Expected blob, got {type_}"
+    with open(path, 'wb') as f:
+        f.writelines(pieces)
+    return data.index_entry(oid, os.stat(path))
+
+def _remove_empty_parents(path):
+    parent = os.path.dirname(path)
+    while parent:
+        try:
+            os.rmdir(parent)
+        except OSError:
+            return
+        parent = os.path.dirname(parent)
 
 def commit(message):
     commit = f"tree {write_tree()}\n"
@@ -192,17 +422,97 @@ def merge(other):
     data.update_ref('MERGED_HEAD', data.RefValue(symbolic=False, value=other))
     c_base = get_commit(merge_base)
     c_HEAD = get_commit(HEAD)
-    read_tree_merged(c_base.tree, c_HEAD.tree, c_other.tree, update_working=True)
+    conflicts = read_tree_merged(c_base.tree, c_HEAD.tree, c_other.tree, update_working=True)
+    for conflict in conflicts:
+        print(f"CONFLICT ({conflict.kind}): Merge conflict in {conflict.path}")
     print('Merged in working tree\nPlease commit')
 
 def get_merge_base(oid1, oid2):
-    parents1= set(iter_commits_and_parents({oid1}))
-    for oid in iter_commits_and_parents({oid2}):
-        if oid in parents1:
+    # Walk both histories together, highest generation first. A commit is only
+    # popped once everything that can reach it has been, so the first one
+    # reached from both sides is a best common ancestor.
+    generation = _generation_lookup()
+    flags = {oid1: 1}
+    flags[oid2] = flags.get(oid2, 0) | 2
+    queue = [(-generation(oid), oid) for oid in flags]
+    heapq.heapify(queue)
+    while queue:
+        _, oid = heapq.heappop(queue)
+        if flags[oid] == 3:
             return oid
+        for parent in get_commit_parents(oid):
+            if parent not in flags:
+                flags[parent] = 0
+                heapq.heappush(queue, (-generation(parent), parent))
+            flags[parent] |= flags[oid]
 
 def is_ancestor_of(commit, maybe_ancestor):
-    return maybe_ancestor in iter_commits_and_parents({commit})
+    # A commit we don't have can't be reached from one we do, and looking up
+    # its generation would fail or fetch it from a promisor remote
+    if not _has_commit(maybe_ancestor):
+        return False
+    # Commits with a lower generation than maybe_ancestor can't reach it
+    generation = _generation_lookup()
+    min_generation = generation(maybe_ancestor)
+    oids = [commit]
+    visited = set()
+    while oids:
+        oid = oids.pop()
+        if oid == maybe_ancestor:
+            return True
+        if oid in visited or generation(oid) < min_generation:
+            continue
+        visited.add(oid)
+        oids.extend(get_commit_parents(oid))
+    return False
+
+def write_commit_graph():
+    commits = {}
+    tips = {ref.value for _, ref in data.iter_refs()}
+    for oid in iter_commits_and_parents(tips):
+        commit = get_commit(oid)
+        commits[oid] = (commit.tree, commit.parents)
+    return data.write_commit_graph(commits)
+
+def get_commit_parents(oid):
+    graph = data.get_commit_graph()
+    position = graph and graph.lookup(oid)
+    if position is not None:
+        return graph.parents(position)
+    return get_commit(oid).parents
+
+def _has_commit(oid):
+    graph = data.get_commit_graph()
+    return (graph is not None and graph.lookup(oid) is not None) or data.object_exists(oid)
+
+def _generation_lookup():
+    # Generation numbers come from the commit graph; commits written after it
+    # get theirs computed from their parents and remembered for the query
+    graph = data.get_commit_graph()
+    generations = {}
+
+    def generation(oid):
+        stack = [oid]
+        while stack:
+            top = stack[-1]
+            if top in generations:
+                stack.pop()
+                continue
+            position = graph and graph.lookup(top)
+            if position is not None:
+                generations[top] = graph.generation(position)
+                stack.pop()
+                continue
+            parents = get_commit(top).parents
+            missing = [parent for parent in parents if parent not in generations]
+            if missing:
+                stack.extend(missing)
+                continue
+            generations[top] = 1 + max((generations[parent] for parent in parents), default=0)
+            stack.pop()
+        return generations[oid]
+
+    return generation
 
 def create_tag(name, oid):
     data.update_ref(f'refs/tags/{name}', data.RefValue(symbolic=False, value=oid))
@@ -228,6 +538,10 @@ def get_branch_name():
 Commit = namedtuple('Commit', ['tree', 'parents', 'message'])
 
 def get_commit(oid):
+    commit_key = data.cache_key('commit', oid)
+    cached = data.object_cache.get(commit_key)
+    if cached is not None:
+        return cached
     parents = []
     commit = data.get_object(oid, 'commit').decode()
     lines = iter(commit.splitlines())
@@ -241,7 +555,9 @@ def get_commit(oid):
             assert False, f"Unknown field {key}"
     
     message = '\n'.join(lines)
-    return Commit(tree=tree, parents=parents, message=message)
+    result = Commit(tree=tree, parents=parents, message=message)
+    data.object_cache.put(commit_key, result, len(commit) + PARSED_COMMIT_SIZE)
+    return result
 
 def iter_commits_and_parents(oids):
     oids = deque(oids)
@@ -253,12 +569,13 @@ def iter_commits_and_parents(oids):
         visited.add(oid)
         yield oid
 
-        commit = get_commit(oid)
+        parents = get_commit_parents(oid)
         # oids.appendleft(commit.parent)
-        oids.extendleft(commit.parents[:1])
-        oids.extend(commit.parents[1:])
+        oids.extendleft(parents[:1])
+        oids.extend(parents[1:])
 
-def iter_objects_in_commits(oids):
+def iter_objects_in_commits(oids, keep_blob=None):
+    # keep_blob, when given, decides which blobs are yielded
     visited = set()
     def iter_objects_in_tree(oid):
         visited.add(oid)
@@ -269,7 +586,8 @@ def iter_objects_in_commits(oids):
                     yield from iter_objects_in_tree(oid)
                 else:
                     visited.add(oid)
-                    yield oid
+                    if keep_blob is None or keep_blob(oid):
+                        yield oid
         
     for oid in iter_commits_and_parents(oids):
         yield oid
@@ -277,6 +595,113 @@ def iter_objects_in_commits(oids):
         if commit.tree not in visited:
             yield from iter_objects_in_tree(commit.tree)
 
+def iter_objects_to_send(wants, haves, blob_limit=None):
+    # Objects reachable from wants but not from haves. With blob_limit, blobs
+    # of that many bytes or more are left out, all of them for 0; bitmaps
+    # don't know which objects are blobs, so those sends walk the trees.
+    keep_blob = None
+    if blob_limit == 0:
+        keep_blob = lambda oid: False
+    elif blob_limit is not None:
+        keep_blob = lambda oid: data.stream_object(oid)[1] < blob_limit
+    # A partial clone's pack lacks the blobs it left out, and its bitmaps
+    # would leave them out of what is sent
+    use_bitmaps = keep_blob is None and data.get_promisor_remote() is None
+    found = data.get_bitmaps() if use_bitmaps else None
+    if found is None:
+        have_objects = set(iter_objects_in_commits(haves))
+        for oid in iter_objects_in_commits(wants, keep_blob):
+            if oid not in have_objects:
+                yield oid
+        return
+
+    pack, bitmaps = found
+    want_bits, want_extra = _reachable_bitmap(wants, pack, bitmaps.get)
+    have_bits, have_extra = _reachable_bitmap(haves, pack, bitmaps.get)
+    for position in _bitmap.iter_positions(want_bits & ~have_bits):
+        yield pack.oid_at(position)
+    yield from want_extra - have_extra
+
+def iter_missing_objects(wants, haves):
+    # Objects reachable from wants but not from haves that aren't stored
+    # here, chunks of chunked blobs included
+    for oid in iter_objects_to_send(wants, haves):
+        if not data.object_exists(oid):
+            yield oid
+            continue
+        for chunk_oid in data.get_chunk_oids(oid) or ():
+            if not data.object_exists(chunk_oid):
+                yield chunk_oid
+
+def write_bitmaps():
+    pack = data.get_main_pack()
+    if pack is None or data.get_promisor_remote() is not None:
+        return 0
+    tips = {ref.value for _, ref in data.iter_refs()}
+    selected = set(tips)
+    for i, oid in enumerate(iter_commits_and_parents(tips)):
+        if i % BITMAP_INTERVAL == 0:
+            selected.add(oid)
+
+    # Oldest first, so every walk stops at the bitmaps computed before it
+    generation = _generation_lookup()
+    bitmaps = {}
+    for oid in sorted((oid for oid in selected if oid in pack), key=generation):
+        bits, extra = _reachable_bitmap({oid}, pack, bitmaps.get)
+        # A bitmap only holds pack objects; one missing the rest would make
+        # sends leave them out
+        if not extra:
+            bitmaps[oid] = bits
+    data.write_bitmaps(pack, bitmaps)
+    return len(bitmaps)
+
+def _reachable_bitmap(oids, pack, get_bitmap):
+    # Bits of the pack objects reachable from oids, plus the set of reachable
+    # objects that aren't in the pack. Walks stop at commits with a stored
+    # bitmap and at anything already marked.
+    bits = bytearray((pack.count + 7) // 8)
+    extra = set()
+
+    def mark(oid):
+        position = pack.position(oid)
+        if position is None:
+            if oid in extra:
+                return False
+            extra.add(oid)
+            return True
+        mask = 1 << (position & 7)
+        if bits[position >> 3] & mask:
+            return False
+        bits[position >> 3] |= mask
+        return True
+
+    def mark_tree(oid):
+        trees = [oid]
+        while trees:
+            oid = trees.pop()
+            if not mark(oid):
+                continue
+            for type_, oid, _ in _iter_tree_entries(oid):
+                if type_ == 'tree':
+                    trees.append(oid)
+                else:
+                    mark(oid)
+
+    commits = list(oids)
+    while commits:
+        oid = commits.pop()
+        if not oid:
+            continue
+        stored = get_bitmap(oid)
+        if stored is not None:
+            bits[:] = (int.from_bytes(bits, 'little') | stored).to_bytes(len(bits), 'little')
+            continue
+        if not mark(oid):
+            continue
+        mark_tree(get_commit(oid).tree)
+        commits.extend(get_commit_parents(oid))
+    return int.from_bytes(bits, 'little'), extra
+
 def get_oid(name):
     if name == '@':
         name = 'HEAD'
@@ -292,34 +717,63 @@ def get_oid(name):
     is_hex = all(c in string.hexdigits for c in name)
     if len(name) == 40 and is_hex:
         return name
+    if is_hex and MIN_ABBREV <= len(name) < 40:
+        matches = data.find_objects(name.lower(), limit=AMBIGUOUS_SHOWN)
+        assert len(matches) < 2, f"Ambiguous name {name}, candidates: {', '.join(matches)}"
+        if matches:
+            return matches[0]
     assert False, f"Unknown name {name}"
 
 def add(filenames):
     def add_file(filename):
         filename = os.path.relpath(filename)
-        with open(filename, 'rb') as f:
-            oid = data.hash_object(f.read())
+        st = os.stat(filename)
+        entry = index.get(filename)
+        if entry and data.is_entry_clean(entry, st, index_mtime):
+            oid = entry.oid
+        else:
+            oid = data.hash_file(filename)
         print(filename)
-        index[filename] = oid
+        index[filename] = data.index_entry(oid, st)
     
     def add_directory(dirname):
-        for root, _, filenames in os.walk(dirname):
+        matcher = data.get_ignore_matcher()
+        dirname = os.path.relpath(dirname)
+        if dirname != '.' and matcher.is_ignored(dirname, is_dir=True):
+            return
+        if working is not None:
+            prefix = '' if dirname == '.' else f"{dirname}/"
+            for path, oid in working.items():
+                entry = index.get(path)
+                if path.startswith(prefix) and (not entry or entry.oid != oid):
+                    add_file(path)
+            return
+        for root, dirnames, filenames in os.walk(dirname):
+            _prune_ignored(root, dirnames, matcher)
             for filename in filenames:
                 path = os.path.relpath(f"{root}/{filename}")
-                if is_ignored(path) or not os.path.isfile(path):
+                if matcher.match(path) or not os.path.isfile(path):
                     continue
                 add_file(path)
 
+    # With an fsmonitor running, the working tree scan only looks at what
+    # changed and only files that differ from the index need adding
+    working = None
+    if any(os.path.isdir(name) for name in filenames) and os.path.exists(_fsmonitor.socket_path(data.GIT_DIR)):
+        working = get_working_tree()
+
     with data.get_index() as index:
+        index_mtime = data.get_index_mtime()
         for name in filenames:
             if os.path.isfile(name):
                 add_file(name)
             elif os.path.isdir(name):
                 add_directory(name)
             
-def is_ignored(path):
-    path_parts = list(Path(path).parts)
-    for ignore_item in data.get_ignore_list():
-        if ignore_item in path_parts:
-            return True
-    return False
+def _prune_ignored(root, dirnames, matcher):
+    # Ignored directories are dropped from the walk instead of having every
+    # file below them checked
+    dirnames[:] = [
+        dirname for dirname in dirnames
+        if not matcher.match(os.path.relpath(f"{root}/{dirname}"), is_dir=True)
+    ]
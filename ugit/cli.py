@@ -1,8 +1,21 @@
 import os
 import sys
-import typer
+import string
+
 import textwrap
-import subprocess
+
+# typer formats help and errors with rich when it can import it, and importing
+# rich takes longer than all of ugit. Unless help is asked for, rich is hidden
+# while typer is imported and put back right after, so whatever else imports
+# it later still gets it.
+_hide_rich = 'rich' not in sys.modules and len(sys.argv) > 1 and '--help' not in sys.argv
+if _hide_rich:
+    sys.modules['rich'] = None
+try:
+    import typer
+finally:
+    if _hide_rich:
+        del sys.modules['rich']
 
 from typing_extensions import Annotated
 from typing import List, Optional
@@ -10,24 +23,82 @@ from typing import List, Optional
 from . import base
 from . import data
 from . import _diff
-from . import _remote
+from . import _trace
+from . import _fsmonitor
+
+# Shell completion setup costs every invocation an importlib.metadata import
+app = typer.Typer(add_completion=False)
+commit_graph_app = typer.Typer()
+app.add_typer(commit_graph_app, name='commit-graph')
 
-app = typer.Typer()
+
+@app.callback()
+def callback(ctx: typer.Context, trace: Annotated[Optional[str], typer.Option(help="'summary' for a summary on stderr, or a file for Chrome trace-event JSON")]=None):
+    if trace:
+        _trace.enable(trace)
+    ctx.with_resource(_trace.span(f"command.{ctx.invoked_subcommand}"))
 
 @app.command()
 def init():
     base.init()
     typer.echo(f"Initialized empty ugit repository in {os.getcwd()}/{data.GIT_DIR}")
 
+def _optional_oid(name):
+    return base.get_oid(name) if name is not None else None
+
 @app.command()
-def hash_object(file: str):
-    with open(file, "rb") as f:
-        typer.echo(data.hash_object(f.read()))
+def hash_object(
+    file: Annotated[Optional[str], typer.Argument()]=None,
+    stdin_paths: Annotated[bool, typer.Option('--stdin-paths', help='Hash the files named on stdin, one per line')]=False,
+    write: Annotated[Optional[bool], typer.Option('--write/--no-write', '-w', help='Store the objects; the default for FILE, not for --stdin-paths')]=None,
+    buffer: Annotated[bool, typer.Option('--buffer', help='Flush only when the output buffer fills, not after every oid')]=False,
+):
+    if not stdin_paths:
+        assert file is not None, "Give a file or --stdin-paths"
+        typer.echo(data.hash_file(file, write=write is not False))
+        return
+    write = bool(write)
+    out = sys.stdout.buffer
+    for line in sys.stdin.buffer:
+        # Paths are passed on as bytes, whatever their encoding
+        path = os.fsdecode(line.rstrip(b'\n'))
+        out.write(data.hash_file(path, write=write).encode() + b'\n')
+        if not buffer:
+            out.flush()
+    out.flush()
 
 @app.command()
-def cat_file(object: Annotated[str, typer.Argument(callback=base.get_oid)]):
+def cat_file(
+    object: Annotated[Optional[str], typer.Argument(callback=_optional_oid)]=None,
+    batch: Annotated[bool, typer.Option('--batch', help="Print '<oid> <type> <size>' and the content of each object named on stdin")]=False,
+    batch_check: Annotated[bool, typer.Option('--batch-check', help='Like --batch without the content')]=False,
+    buffer: Annotated[bool, typer.Option('--buffer', help='Flush only when the output buffer fills, not after every object')]=False,
+):
+    if batch or batch_check:
+        _cat_file_batch(sys.stdin.buffer, sys.stdout.buffer, batch, buffer)
+        return
+    assert object is not None, "Give an object or --batch"
     sys.stdout.flush()
-    sys.stdout.buffer.write(data.get_object(object, expected=None))
+    sys.stdout.buffer.writelines(data.stream_object(object)[2])
+
+def _cat_file_batch(names, out, contents, buffer):
+    # Unknown names get '<name> missing' so a driving program can keep going
+    for line in names:
+        name = os.fsdecode(line.rstrip(b'\n'))
+        try:
+            # Full oids skip the ref lookups get_oid tries first
+            oid = name if len(name) == 40 and all(c in string.hexdigits for c in name) else base.get_oid(name)
+            type_, size, pieces = data.stream_object(oid)
+        except (AssertionError, ValueError, OSError):
+            out.write(os.fsencode(name) + b' missing\n')
+        else:
+            out.write(f"{oid} {type_} {size}\n".encode())
+            if contents:
+                out.writelines(pieces)
+                out.write(b'\n')
+        if not buffer:
+            out.flush()
+    out.flush()
 
 
 @app.command()
@@ -35,8 +106,8 @@ def write_tree():
     print(base.write_tree())
 
 @app.command()
-def read_tree(tree: Annotated[str, typer.Argument(callback=base.get_oid)]):
-    base.read_tree(tree)
+def read_tree(tree: Annotated[str, typer.Argument(callback=base.get_oid)], update: Annotated[bool, typer.Option('--update', '-u')]=False):
+    base.read_tree(tree, update_working=update)
 
 @app.command()
 def commit(message: Annotated[str, typer.Option("--message", "-m")]):
@@ -59,7 +130,7 @@ def log(oid: Annotated[str, typer.Option(callback=base.get_oid)]='@'):
         _print_commit(oid, commit, refs.get(oid))
 
 @app.command()
-def show(oid: Annotated[str, typer.Option(callback=base.get_oid)]='@'):
+def show(oid: Annotated[str, typer.Option(callback=base.get_oid)]='@', find_copies: Annotated[bool, typer.Option('--find-copies', '-C')]=False):
     if not oid:
         return
     commit = base.get_commit(oid)
@@ -67,29 +138,34 @@ def show(oid: Annotated[str, typer.Option(callback=base.get_oid)]='@'):
     if commit.parents:
         parent_tree = base.get_commit(commit.parents[0]).tree
     _print_commit(oid, commit)
-    result = _diff.diff_trees(base.get_tree(parent_tree), base.get_tree(commit.tree))
-    sys.stdout.flush()
-    sys.stdout.write(result)
+    old_tree = base.get_tree(parent_tree) if find_copies and parent_tree else None
+    changes = _diff.find_renames(base.iter_tree_changes(parent_tree, commit.tree), copies=find_copies, old_tree=old_tree)
+    sys.stdout.writelines(_diff.diff_changes(changes))
 
 @app.command()
-def diff(commit: Annotated[Optional[str], typer.Argument()]=None, cached: Annotated[bool, typer.Option('--cached')]=False):
+def diff(commit: Annotated[Optional[str], typer.Argument()]=None, cached: Annotated[bool, typer.Option('--cached')]=False, find_copies: Annotated[bool, typer.Option('--find-copies', '-C')]=False):
     oid = commit and base.get_oid(commit)
-    if commit:
-        tree_from = base.get_tree(oid and base.get_commit(oid).tree)
     
+    to_working = not cached
+    tree_from = None
     if cached:
-        tree_to = base.get_index_tree()
+        # Both sides are trees: walk them together, skipping unchanged subtrees
         if not commit:
             oid = base.get_oid('@')
-            tree_from = base.get_tree(oid and base.get_commit(oid).tree)
+        index_tree, index_trees = base.get_index_tree_oid()
+        commit_tree = oid and base.get_commit(oid).tree
+        changes = base.iter_tree_changes(commit_tree, index_tree, index_trees)
+        if find_copies and commit_tree:
+            tree_from = base.get_tree(commit_tree)
     else:
-        tree_to = base.get_working_tree()
-        if not commit:
+        if commit:
+            tree_from = base.get_tree(oid and base.get_commit(oid).tree)
+        else:
             tree_from = base.get_index_tree()
+        changes = _diff.iter_changes(tree_from, base.get_working_tree())
     
-    result = _diff.diff_trees(tree_from, tree_to)
-    sys.stdout.flush()
-    sys.stdout.write(result)
+    changes = _diff.find_renames(changes, to_working, copies=find_copies, old_tree=tree_from)
+    sys.stdout.writelines(_diff.diff_changes(changes, to_working))
 
 # @app.command()
 # def checkout(oid: Annotated[str, typer.Argument(callback=base.get_oid)]):
@@ -138,6 +214,7 @@ def k():
             dot += f"'{oid}' -> '{parent}'\n"
     dot += '}'
     print(dot)
+    import subprocess
     with subprocess.Popen(['dot', '-Tgtk', '/dev/stdin'], stdin=subprocess.PIPE) as proc:
         proc.communicate(dot.encode())
 
@@ -154,10 +231,11 @@ def status():
         print(f"Merging branch {MERGED_HEAD[:10]}")
     print("\nChanges to be commited:\n")
     HEAD_tree = HEAD and base.get_commit(HEAD).tree
-    for path, action in _diff.iter_changed_files(base.get_tree(HEAD_tree), base.get_index_tree()):
+    index_tree, index_trees = base.get_index_tree_oid()
+    for path, action in _diff.describe_changes(_diff.find_renames(base.iter_tree_changes(HEAD_tree, index_tree, index_trees))):
         print(f"{action:>12}: {path}")
     print("\nChanges not staged for commit:\n")
-    for path, action in _diff.iter_changed_files(base.get_index_tree(), base.get_working_tree()):
+    for path, action in _diff.iter_changed_files(base.get_index_tree(), base.get_working_tree(), to_working=True):
         print(f"{action:>12}: {path}")
 
 
@@ -174,20 +252,63 @@ def merge_base(commit1: Annotated[str, typer.Argument(callback=base.get_oid)], c
     print(base.get_merge_base(commit1, commit2))
 
 @app.command()
-def fetch(remote: Annotated[str, typer.Argument()]):
-    _remote.fetch(remote)
+def fetch(remote: Annotated[str, typer.Argument()], filter_spec: Annotated[Optional[str], typer.Option('--filter', help='blob:none or blob:limit=<size>[kmg] for a partial clone')]=None):
+    from . import _remote
+    _remote.fetch(remote, filter_spec)
 
 @app.command()
 def push(remote: Annotated[str, typer.Argument()], branch: Annotated[str, typer.Argument()]):
+    from . import _remote
     _remote.push(remote, f"refs/heads/{branch}")
 
+@app.command()
+def serve(socket: Annotated[Optional[str], typer.Option()]=None):
+    from . import _transport
+    if socket:
+        _transport.serve_socket(socket)
+    else:
+        _transport.serve(sys.stdin.buffer, sys.stdout.buffer)
+
+@app.command()
+def fsmonitor(foreground: Annotated[bool, typer.Option()]=False, stop: Annotated[bool, typer.Option()]=False):
+    if stop:
+        _fsmonitor.stop(data.GIT_DIR)
+    elif foreground:
+        _fsmonitor.serve('.', data.GIT_DIR)
+    else:
+        import subprocess
+        env = {name: value for name, value in os.environ.items() if name != 'UGIT_TRACE'}
+        subprocess.Popen(
+            [sys.executable, '-m', 'ugit.cli', 'fsmonitor', '--foreground'],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            env=env, start_new_session=True,
+        )
+
 @app.command()
 def add(files: Annotated[List[str], typer.Argument()]):
     base.add(files)
 
+@commit_graph_app.command('write')
+def commit_graph_write():
+    print(f"Wrote commit graph with {base.write_commit_graph()} commits")
+
+@app.command()
+def repack(codec: Annotated[Optional[str], typer.Option()]=None, write_bitmap: Annotated[bool, typer.Option()]=True):
+    print(f"Packed {data.repack(codec)} objects")
+    if write_bitmap:
+        print(f"Wrote {base.write_bitmaps()} reachability bitmaps")
+
+@app.command()
+def pack_refs():
+    print(f"Packed {data.pack_refs()} refs")
+
 def main():
-    with data.change_git_dir('.'):
-        app()
+    _trace.enable_from_env()
+    try:
+        with data.change_git_dir('.'):
+            app()
+    finally:
+        _trace.finish()
 
 
 if __name__ == "__main__":
@@ -1,12 +1,46 @@
+import io
 import os
+import stat
+import string
 import hashlib
-import shutil
 import orjson
 
 from collections import namedtuple
 from contextlib import contextmanager
 
+from . import _pack
+from . import _codec
+from . import _cache
+from . import _commit_graph
+from . import _bitmap
+from . import _ignore
+from . import _packed_refs
+from . import _index
+from . import _chunk
+
 GIT_DIR = None
+OBJECT_CODEC = os.environ.get('UGIT_CODEC', 'zlib')
+# Blobs this large are stored as a manifest of content-defined chunks
+CHUNK_THRESHOLD = int(os.environ.get('UGIT_CHUNK_THRESHOLD', 8 * 1024 * 1024))
+# Files are read this much at a time when hashing without storing
+READ_SIZE = 1024 * 1024
+# Received packs with fewer objects than this are stored as loose objects,
+# like git's transfer.unpackLimit, so lazy fetches don't leave a pack each
+UNPACK_LIMIT = 100
+# Objects and their parsed forms, keyed by cache_key(): objects are
+# immutable, but another repository may not have them
+object_cache = _cache.LRUCache(int(os.environ.get('UGIT_CACHE_SIZE', 64 * 1024 * 1024)))
+_packs = {}
+_commit_graphs = {}
+_bitmaps = {}
+_ignore_matchers = {}
+_packed_ref_files = {}
+# Raw ref values read by this process with the stat of the file they came
+# from, dropped whenever it changes a ref
+_ref_caches = {}
+# The caches above are per repository, keyed by the real path of its GIT_DIR
+# so that one reached by different paths shares them
+_repo_keys = {}
 
 @contextmanager
 def change_git_dir(new_dir):
@@ -17,23 +51,40 @@ def change_git_dir(new_dir):
     yield
     GIT_DIR = old_dir
 
+def _repo_key():
+    location = (os.getcwd(), GIT_DIR)
+    key = _repo_keys.get(location)
+    if key is None:
+        key = _repo_keys[location] = os.path.realpath(GIT_DIR)
+    return key
+
+def cache_key(*parts):
+    return (_repo_key(), *parts)
+
 def init():
     os.makedirs(GIT_DIR, exist_ok=True)
     os.makedirs(f"{GIT_DIR}/objects", exist_ok=True)
+    _migrate_objects_to_fanout()
 
 def get_ref(ref, deref=True):
     return _get_ref_internal(ref, deref)[1]
 
 def delete_ref(ref, deref=True):
     ref = _get_ref_internal(ref, deref)[0]
-    os.remove(f'{GIT_DIR}/{ref}')
+    clear_ref_cache()
+    ref_path = f'{GIT_DIR}/{ref}'
+    packed = get_packed_refs()
+    if packed is not None and packed.get(ref):
+        refs = dict(packed.iter())
+        del refs[ref]
+        _write_packed_refs(refs)
+        if os.path.isfile(ref_path):
+            os.remove(ref_path)
+        return
+    os.remove(ref_path)
 
 def _get_ref_internal(ref, deref):
-    ref_path = f"{GIT_DIR}/{ref}"
-    value = None
-    if os.path.isfile(ref_path):
-        with open(ref_path) as f:
-            value = f.read().strip()
+    value = _read_ref(ref)
     
     # if value and value.startswith('ref:'):
     #     return get_ref(value.split(':', 1))[1].strip()
@@ -45,6 +96,56 @@ def _get_ref_internal(ref, deref):
     
     return ref, RefValue(symbolic=symbolic, value=value)
 
+def _read_ref(ref):
+    # A loose ref file overrides the packed one. Values are read again when
+    # the file they came from changed, also when another process changed it.
+    cache = _ref_caches.setdefault(_repo_key(), {})
+    signature = _ref_signature(ref)
+    cached = cache.get(ref)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    value = None
+    if signature is None:
+        pass
+    elif signature[0] == 'loose':
+        with open(f"{GIT_DIR}/{ref}") as f:
+            value = f.read().strip()
+    else:
+        value = get_packed_refs().get(ref)
+    cache[ref] = (signature, value)
+    return value
+
+def _ref_signature(ref):
+    signature = _file_signature(f"{GIT_DIR}/{ref}")
+    if signature is not None:
+        return ('loose', *signature)
+    if ref.startswith('refs/'):
+        signature = _file_signature(packed_refs_path())
+        if signature is not None:
+            return ('packed', *signature)
+    return None
+
+def _file_signature(path):
+    try:
+        st = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def clear_ref_cache():
+    _ref_caches.pop(_repo_key(), None)
+
+def drop_caches():
+    # For long-lived processes: packs, bitmaps and the commit graph are read
+    # again, in case another process repacked or rewrote them meanwhile
+    clear_ref_cache()
+    _close_packs()
+    graph = _commit_graphs.pop(_repo_key(), None)
+    if graph is not None:
+        graph.close()
+
 RefValue = namedtuple('RefValue', ['symbolic', 'value'])
 
 def update_ref(ref, value, deref=True):
@@ -60,7 +161,46 @@ def update_ref(ref, value, deref=True):
     os.makedirs(os.path.dirname(ref_path), exist_ok=True)
     with open(ref_path, 'w') as f:
         f.write(value)
+    clear_ref_cache()
+
+def packed_refs_path():
+    return f"{GIT_DIR}/packed-refs"
+
+def get_packed_refs():
+    # Reopened whenever the file is replaced, also by another process
+    signature = _file_signature(packed_refs_path())
+    if signature is None:
+        return None
+    key = _repo_key()
+    cached = _packed_ref_files.get(key)
+    if cached is None or cached[0] != signature:
+        if cached is not None:
+            cached[1].close()
+        cached = _packed_ref_files[key] = (signature, _packed_refs.PackedRefs(packed_refs_path()))
+    return cached[1]
 
+def _write_packed_refs(refs):
+    cached = _packed_ref_files.pop(_repo_key(), None)
+    if cached is not None:
+        cached[1].close()
+    _packed_refs.write(packed_refs_path(), refs)
+
+def pack_refs():
+    # Moves every loose ref under refs/ that points at an oid into
+    # packed-refs. Symbolic refs stay loose.
+    packed = get_packed_refs()
+    refs = dict(packed.iter()) if packed is not None else {}
+    loose = []
+    for refname in _iter_loose_refnames('refs/'):
+        value = _read_ref(refname)
+        if value and not value.startswith('ref:'):
+            refs[refname] = value
+            loose.append(refname)
+    _write_packed_refs(refs)
+    for refname in loose:
+        os.remove(f"{GIT_DIR}/{refname}")
+    clear_ref_cache()
+    return len(refs)
 
 # def set_HEAD(oid):
 #     with open(f"{GIT_DIR}/HEAD", 'w') as f:
@@ -72,59 +212,408 @@ def update_ref(ref, value, deref=True):
 #             return f.read().strip()
 
 def iter_refs(prefix = '', deref=True):
-    refs = ['HEAD', 'MERGED_HEAD']
-    for root, _, filenames in os.walk(f"{GIT_DIR}/refs"):
-        root = os.path.relpath(root, GIT_DIR)
-        refs.extend(f"{os.path.join(root, name)}" for name in filenames)
-    
+    refs = [refname for refname in ('HEAD', 'MERGED_HEAD') if refname.startswith(prefix)]
+    loose = set(_iter_loose_refnames(prefix))
+    cache = _ref_caches.setdefault(_repo_key(), {})
+    packed = get_packed_refs()
+    if packed is not None:
+        signature = ('packed', *_file_signature(packed_refs_path()))
+        for refname, oid in packed.iter(prefix):
+            # Fill the cache from the scan instead of searching for each ref
+            if refname not in loose:
+                cache[refname] = (signature, oid)
+            loose.add(refname)
+    refs.extend(sorted(loose))
+
     for refname in refs:
-        if not refname.startswith(prefix) and not refname.startswith(prefix.replace('/','\\')):
-            continue
         ref = get_ref(refname, deref=deref)
         if ref.value:
             yield refname, ref
 
+def _iter_loose_refnames(prefix):
+    # Only the directory holding prefix is walked
+    top = os.path.dirname(prefix) if prefix.startswith('refs/') else 'refs'
+    for root, _, filenames in os.walk(f"{GIT_DIR}/{top}"):
+        root = os.path.relpath(root, GIT_DIR).replace(os.sep, '/')
+        for name in filenames:
+            refname = f"{root}/{name}"
+            if refname.startswith(prefix):
+                yield refname
+
+IndexEntry = _index.IndexEntry
+
+def index_entry(oid, st=None):
+    if st is None:
+        return IndexEntry(oid, 0, 0, 0, 0)
+    return IndexEntry(oid, st.st_mtime_ns, st.st_size, st.st_ino, st.st_mode)
+
 @contextmanager
 def get_index():
-    index = {}
-    if os.path.isfile(f"{GIT_DIR}/index"):
-        with open(f"{GIT_DIR}/index", 'rb') as f:
-            index = orjson.loads(f.read())
-    yield index
+    # The index is only written back when an entry changed
+    index = _index.Index(f"{GIT_DIR}/index")
+    try:
+        yield index
+        if index.dirty:
+            index.write()
+    finally:
+        index.close()
+
+def get_index_signature():
+    try:
+        st = os.stat(f"{GIT_DIR}/index")
+    except FileNotFoundError:
+        return None
+    return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+def get_fsmonitor_state():
+    try:
+        with open(f"{GIT_DIR}/fsmonitor-state", 'rb') as f:
+            return orjson.loads(f.read())
+    except FileNotFoundError:
+        return None
 
-    with open(f"{GIT_DIR}/index", 'wb') as f:
-        f.write(orjson.dumps(index))
+def set_fsmonitor_state(state):
+    tmp_path = f"{GIT_DIR}/fsmonitor-state.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(orjson.dumps(state))
+    os.replace(tmp_path, f"{GIT_DIR}/fsmonitor-state")
 
-def hash_object(data, type_='blob'):
+def get_index_mtime():
+    try:
+        return os.stat(f"{GIT_DIR}/index").st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+def is_entry_clean(entry, st, index_mtime):
+    # An entry whose mtime is not older than the index itself is racy: the file
+    # may have changed again within the same timestamp tick, so it must be rehashed
+    return (
+        entry.mtime_ns == st.st_mtime_ns and
+        entry.size == st.st_size and
+        entry.ino == st.st_ino and
+        entry.mode == st.st_mode and
+        entry.mtime_ns < index_mtime
+    )
+
+def hash_object(data, type_='blob', write=True):
+    if type_ == 'blob' and write and len(data) >= CHUNK_THRESHOLD:
+        return _write_chunked(io.BytesIO(data))
     obj = type_.encode() + b'\x00' + data
     oid = hashlib.sha1(obj).hexdigest()
-    with open(f"{GIT_DIR}/objects/{oid}", 'wb') as out:
-        out.write(obj)
+    if write:
+        _write_object(oid, obj)
+    return oid
+
+def hash_file(path, write=True):
+    # Same oid as hash_object of the file's content, without ever holding
+    # more than a chunk of a large file in memory
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < CHUNK_THRESHOLD:
+            return hash_object(f.read(), write=write)
+        if write:
+            return _write_chunked(f)
+        sha = hashlib.sha1(b'blob\x00')
+        while data := f.read(READ_SIZE):
+            sha.update(data)
+        return sha.hexdigest()
+
+def _write_chunked(f):
+    # A chunked blob keeps the oid of its whole content but is stored as a
+    # 'chunked' object listing its chunks, which are blobs of their own.
+    # Chunks unchanged since an earlier version are already stored.
+    sha = hashlib.sha1(b'blob\x00')
+    manifest = []
+    for chunk in _chunk.iter_chunks(f):
+        sha.update(chunk)
+        obj = b'blob\x00' + chunk
+        chunk_oid = hashlib.sha1(obj).hexdigest()
+        if not object_exists(chunk_oid):
+            _write_object(chunk_oid, obj)
+        manifest.append(f"{chunk_oid} {len(chunk)}\n")
+    oid = sha.hexdigest()
+    _write_object(oid, b'chunked\x00' + ''.join(manifest).encode())
     return oid
 
+def _object_path(oid):
+    return f"{GIT_DIR}/objects/{oid[:2]}/{oid[2:]}"
+
+def _legacy_object_path(oid):
+    return f"{GIT_DIR}/objects/{oid}"
+
+def _write_object(oid, obj):
+    path = _object_path(oid)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as out:
+        out.write(_codec.compress(obj, OBJECT_CODEC))
+
+def _read_object(oid):
+    obj = _read_local_object(oid)
+    if obj is None and get_promisor_remote() is not None:
+        # Left out by a partial clone: fetch it now. Callers about to read
+        # many objects prefetch them to save a round trip each.
+        _fetch_promised([oid])
+        obj = _read_local_object(oid)
+    if obj is None:
+        raise FileNotFoundError(f"Object {oid} not found")
+    return obj
+
+def _read_local_object(oid):
+    for pack in _get_packs():
+        obj = pack.read(oid)
+        if obj is not None:
+            return obj
+    for path in (_object_path(oid), _legacy_object_path(oid)):
+        try:
+            with open(path, 'rb') as f:
+                return _codec.decompress(f.read())
+        except FileNotFoundError:
+            pass
+    return None
+
 def get_object(oid, expected='blob'):
-    with open(f"{GIT_DIR}/objects/{oid}", 'rb') as f:
-        obj = f.read()
-    type_, _, content = obj.partition(b'\x00')
-    type_ = type_.decode()
+    type_, content = get_typed_object(oid)
     if expected is not None:
         assert type_ == expected, f"Expected {expected}, got {type_}"
     return content
 
+def get_typed_object(oid):
+    key = cache_key(oid)
+    obj = object_cache.get(key)
+    if obj is None:
+        obj = _read_object(oid)
+        object_cache.put(key, obj, len(obj))
+    type_, _, content = obj.partition(b'\x00')
+    if type_ == b'chunked':
+        return 'blob', b''.join(_iter_chunk_contents(content))
+    return type_.decode(), content
+
+def stream_object(oid):
+    # (type, size, iterator over the content in pieces), reading one chunk
+    # of a chunked blob at a time
+    obj = object_cache.get(cache_key(oid))
+    if obj is None:
+        obj = _read_object(oid)
+    type_, _, content = obj.partition(b'\x00')
+    if type_ == b'chunked':
+        manifest = _parse_manifest(content)
+        return 'blob', sum(size for _, size in manifest), _iter_chunk_contents(content)
+    return type_.decode(), len(content), iter([content])
+
+def get_chunk_oids(oid):
+    # The chunks of a chunked blob, None for any other object
+    key = cache_key(oid)
+    obj = object_cache.get(key)
+    if obj is None:
+        obj = _read_object(oid)
+        object_cache.put(key, obj, len(obj))
+    type_, _, content = obj.partition(b'\x00')
+    if type_ != b'chunked':
+        return None
+    return [chunk_oid for chunk_oid, _ in _parse_manifest(content)]
+
+def _iter_chunk_contents(manifest):
+    # Chunks are read around the object cache so one large file doesn't
+    # evict everything else from it
+    chunk_oids = [chunk_oid for chunk_oid, _ in _parse_manifest(manifest)]
+    prefetch_objects(chunk_oids)
+    for chunk_oid in chunk_oids:
+        yield _read_object(chunk_oid).partition(b'\x00')[2]
+
+def _parse_manifest(content):
+    manifest = []
+    for line in content.decode().splitlines():
+        chunk_oid, size = line.split(' ')
+        manifest.append((chunk_oid, int(size)))
+    return manifest
+
 def object_exists(oid):
-    return os.path.isfile(f"{GIT_DIR}/objects/{oid}")
+    if any(oid in pack for pack in _get_packs()):
+        return True
+    return os.path.isfile(_object_path(oid)) or os.path.isfile(_legacy_object_path(oid))
+
+def get_promisor_remote():
+    # The remote a partial clone was fetched from, which has every object
+    # missing here
+    try:
+        with open(f"{GIT_DIR}/promisor", 'rb') as f:
+            return orjson.loads(f.read())['remote']
+    except FileNotFoundError:
+        return None
+
+def set_promisor_remote(remote):
+    tmp_path = f"{GIT_DIR}/promisor.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(orjson.dumps({'remote': remote}))
+    os.replace(tmp_path, f"{GIT_DIR}/promisor")
+
+def prefetch_objects(oids):
+    # Fetches in one round trip whichever of oids a partial clone left out
+    if get_promisor_remote() is None:
+        return
+    missing = sorted({oid for oid in oids if oid and not object_exists(oid)})
+    if missing:
+        _fetch_promised(missing)
+
+def _fetch_promised(oids):
+    from . import _remote
+    try:
+        _remote.fetch_objects(get_promisor_remote(), oids)
+    except AssertionError as e:
+        raise FileNotFoundError(f"Objects missing from the promisor remote too: {e}") from e
 
-def fetch_object_if_missing(oid, remote_git_dir):
-    if object_exists(oid):
+def find_objects(prefix, limit=None):
+    # Oids of stored objects starting with prefix (lowercase hex, at least
+    # two digits), at most limit of them
+    found = set()
+    for pack in _get_packs():
+        for oid in pack.iter_prefix(prefix):
+            found.add(oid)
+            if limit and len(found) >= limit:
+                return sorted(found)
+    # Loose objects all live under objects/ab/ since the fan-out migration
+    loose_dir = f"{GIT_DIR}/objects/{prefix[:2]}"
+    if os.path.isdir(loose_dir):
+        for rest in os.listdir(loose_dir):
+            if rest.startswith(prefix[2:]) and _is_hex(rest, 38):
+                found.add(prefix[:2] + rest)
+                if limit and len(found) >= limit:
+                    break
+    return sorted(found)
+
+def write_pack_stream(out, oids):
+    # The transport has just read most of these to look for chunked blobs
+    _pack.write_pack_stream(out, oids, lambda oid: object_cache.get(cache_key(oid)) or _read_object(oid), OBJECT_CODEC)
+
+def receive_pack_stream(stream):
+    pack_path = _pack.store_pack_stream(f"{GIT_DIR}/objects/pack", stream, UNPACK_LIMIT, _write_object)
+    if pack_path is not None:
+        # Reopen the packs so the new one is visible
+        _close_packs()
+
+def _get_packs():
+    key = _repo_key()
+    packs = _packs.get(key)
+    if packs is None:
+        packs = _packs[key] = _pack.load_packs(f"{GIT_DIR}/objects/pack")
+    return packs
+
+def _close_packs():
+    key = _repo_key()
+    _bitmaps.pop(key, None)
+    for pack in _packs.pop(key, []):
+        pack.close()
+
+def get_main_pack():
+    return max(_get_packs(), key=lambda pack: pack.count, default=None)
+
+def get_bitmaps():
+    # The pack carrying reachability bitmaps and its bitmaps, if there is one
+    key = _repo_key()
+    if key not in _bitmaps:
+        _bitmaps[key] = next((
+            (pack, _bitmap.Bitmaps(pack.bitmap_path))
+            for pack in _get_packs()
+            if os.path.isfile(pack.bitmap_path)
+        ), None)
+    return _bitmaps[key]
+
+def write_bitmaps(pack, bitmaps):
+    _bitmaps.pop(_repo_key(), None)
+    _bitmap.write(pack.bitmap_path, bitmaps)
+
+def _is_hex(name, length):
+    return len(name) == length and all(c in string.hexdigits for c in name)
+
+def commit_graph_path():
+    return f"{GIT_DIR}/objects/info/commit-graph"
+
+def get_commit_graph():
+    key = _repo_key()
+    if key not in _commit_graphs:
+        path = commit_graph_path()
+        _commit_graphs[key] = _commit_graph.CommitGraph(path) if os.path.isfile(path) else None
+    return _commit_graphs[key]
+
+def write_commit_graph(commits):
+    graph = _commit_graphs.pop(_repo_key(), None)
+    if graph is not None:
+        graph.close()
+    return _commit_graph.write(commit_graph_path(), commits)
+
+def _iter_loose_objects():
+    objects_dir = f"{GIT_DIR}/objects"
+    for name in os.listdir(objects_dir):
+        if _is_hex(name, 40):
+            yield name, f"{objects_dir}/{name}"
+        elif _is_hex(name, 2):
+            for rest in os.listdir(f"{objects_dir}/{name}"):
+                if _is_hex(rest, 38):
+                    yield name + rest, f"{objects_dir}/{name}/{rest}"
+
+def _migrate_objects_to_fanout():
+    # Moves objects/<oid> to objects/<oid[:2]>/<oid[2:]>. Every move is an
+    # atomic rename, so an interrupted migration simply resumes on the next
+    # run; the marker is only written once nothing is left to move.
+    marker = f"{GIT_DIR}/objects/.fanout"
+    if os.path.exists(marker):
         return
-    remote_git_dir += '/.ugit'
-    shutil.copy(f"{remote_git_dir}/objects/{oid}", f"{GIT_DIR}/objects/{oid}")
+    for name in os.listdir(f"{GIT_DIR}/objects"):
+        if _is_hex(name, 40):
+            path = _object_path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(_legacy_object_path(name), path)
+    open(marker, 'w').close()
+
+def repack(codec=None):
+    loose = dict(_iter_loose_objects())
+    old_packs = _get_packs()
+    oids = set(loose)
+    for pack in old_packs:
+        oids.update(pack.iter_oids())
+    if not loose and len(old_packs) <= 1:
+        return len(oids)
 
-def push_object(oid, remote_git_dir):
-    remote_git_dir += '/.ugit'
-    shutil.copy(f"{GIT_DIR}/objects/{oid}", f"{remote_git_dir}/objects/{oid}")
+    pack_path = _pack.write_pack(
+        f"{GIT_DIR}/objects/pack", sorted(oids), _read_object, codec or OBJECT_CODEC
+    )
+    # Only drop what the new pack supersedes once it is safely in place
+    old_paths = [(pack.pack_path, pack.index_path, pack.bitmap_path) for pack in old_packs]
+    _close_packs()
+    for pack_file, index_file, bitmap_file in old_paths:
+        if pack_file != pack_path:
+            if os.path.isfile(bitmap_file):
+                os.remove(bitmap_file)
+            os.remove(index_file)
+            os.remove(pack_file)
+    for path in loose.values():
+        os.remove(path)
+    for dirname in {os.path.dirname(path) for path in loose.values()}:
+        try:
+            os.rmdir(dirname)
+        except OSError:
+            pass
+    return len(oids)
+
+def _ignore_file():
+    return os.path.join(os.path.dirname(GIT_DIR), '.ugitignore')
 
 def get_ignore_list():
-    with open(os.path.join(os.path.dirname(GIT_DIR), '.ugitignore'), 'r') as f:
-        return [line.strip() for line in f.readlines() if not line.startswith('#') and line.strip() != '']
+    try:
+        with open(_ignore_file(), 'r') as f:
+            return [line.strip() for line in f.readlines() if not line.startswith('#') and line.strip() != '']
+    except FileNotFoundError:
+        return []
+
+def get_ignore_matcher():
+    # Parsed once, and again only when .ugitignore changes
+    try:
+        st = os.stat(_ignore_file())
+        signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+    except FileNotFoundError:
+        signature = None
+    key = _repo_key()
+    cached = _ignore_matchers.get(key)
+    if cached is None or cached[0] != signature:
+        cached = _ignore_matchers[key] = (signature, _ignore.IgnoreMatcher(get_ignore_list()))
+    return cached[1]
 